@@ -0,0 +1,99 @@
+import threading
+from typing import Any, Dict, NamedTuple, Optional
+from bin.queue_index import QueueStats
+
+
+class PrintTimes:
+    """Moving average of measured print time per job, split by text and image jobs."""
+
+    def __init__(self, text_s: float = 2.0, image_s: float = 6.0, alpha: float = 0.2) -> None:
+        self.text_s = text_s
+        self.image_s = image_s
+        self.alpha = alpha
+        self._lock = threading.Lock()
+
+    def observe(self, has_image: bool, seconds: float) -> None:
+        with self._lock:
+            if has_image:
+                self.image_s += self.alpha * (seconds - self.image_s)
+            else:
+                self.text_s += self.alpha * (seconds - self.text_s)
+
+    def eta(self, stats: QueueStats) -> float:
+        """Estimated seconds to print everything currently queued."""
+        with self._lock:
+            return (stats.queued - stats.images) * self.text_s + stats.images * self.image_s
+
+
+class LazyPrintTimes:
+    """
+    PrintTimes seeded from `queue.admission.initial_estimate_s`, created the
+    first time it is used, so importing the server does not load the config.
+    """
+
+    def __init__(self) -> None:
+        self._times: Optional[PrintTimes] = None
+        self._lock = threading.Lock()
+
+    def _get(self) -> PrintTimes:
+        if self._times is None:
+            with self._lock:
+                if self._times is None:
+                    from bin.load import CONFIG
+
+                    self._times = PrintTimes(
+                        **CONFIG.get("queue", {}).get("admission", {}).get("initial_estimate_s", {})
+                    )
+        return self._times
+
+    def __getattr__(self, attr: str) -> Any:
+        return getattr(self._get(), attr)
+
+
+class Admission(NamedTuple):
+    accept: bool
+    drop_image: bool = False
+    retry_after: float = 0.0
+    reason: str = ""
+
+
+def admit(
+    config: Dict[str, Any],
+    stats: QueueStats,
+    eta: float,
+    has_image: bool,
+    has_text: bool,
+    urgent: bool,
+) -> Admission:
+    """
+    Decide whether a new message may enter the queue.
+
+    Length and byte limits protect the disk and apply to every message. The
+    time-to-print limit keeps the latency promise; urgent (priority) messages
+    are exempt from it. Above `degrade_at` of that limit, images are dropped
+    from messages that also carry text.
+    """
+    retry_default = config.get("retry_after_s", 60)
+
+    max_length = config.get("max_length", 0)
+    if max_length and stats.queued >= max_length:
+        return Admission(False, retry_after=max(eta / stats.queued, 1), reason="queue full")
+
+    max_bytes = config.get("max_bytes", 0)
+    if max_bytes and stats.bytes >= max_bytes:
+        return Admission(False, retry_after=retry_default, reason="queue size limit")
+
+    max_eta = config.get("max_eta_s", 0)
+    if not max_eta or urgent:
+        return Admission(True)
+
+    if eta >= max_eta:
+        return Admission(False, retry_after=eta - max_eta + 1, reason="time-to-print limit")
+
+    degrade_at = config.get("degrade_at", 0)
+    if has_image and degrade_at and eta >= degrade_at * max_eta:
+        if not has_text:
+            return Admission(False, retry_after=eta - degrade_at * max_eta + 1, reason="images paused")
+        return Admission(True, drop_image=True, reason="images paused")
+
+    return Admission(True)
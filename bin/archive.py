@@ -0,0 +1,131 @@
+import base64
+import dataclasses
+import gzip
+import hashlib
+import json
+import re
+from collections import Counter
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Dict, List, NamedTuple, Optional
+from bin.db import acquire_image, iter_records, release_image, store_records
+from bin.images import digest_of_path, path_for_digest, write_image_data
+from bin.logger import logging
+from bin.record import QueueRecord, encode_message
+
+ARCHIVE_FORMAT = "print-queue"
+ARCHIVE_VERSION = 1
+IMPORT_BATCH = 1000
+_DIGEST = re.compile(r"[0-9a-f]{64}")
+
+
+class ImportResult(NamedTuple):
+    stored: int
+    skipped: int
+    images: int
+
+
+def _line(entry: Dict[str, Any]) -> str:
+    return json.dumps(entry, separators=(",", ":")) + "\n"
+
+
+def _with_image(record: QueueRecord, image_path: Optional[str]) -> QueueRecord:
+    message = dataclasses.replace(record.to_message(), image_path=image_path)
+    return QueueRecord(encode_message(message))
+
+
+def export_queue(path: Path) -> int:
+    """
+    Stream the queue to a gzip-compressed JSON-lines archive. Each image is
+    written once, before the first message that uses it. Safe while the
+    service runs: shards are copied one at a time under their own lock.
+    Returns the number of messages exported.
+    """
+    log = logging.getLogger(__name__)
+    written: set = set()
+    count = 0
+    with gzip.open(path, "wt", encoding="utf-8") as out:
+        out.write(
+            _line(
+                {
+                    "format": ARCHIVE_FORMAT,
+                    "version": ARCHIVE_VERSION,
+                    "exported": datetime.now().isoformat(),
+                }
+            )
+        )
+        for record in iter_records():
+            entry: Dict[str, Any] = {"rec": record.raw}
+            if image_path := record.image_path:
+                try:
+                    data = Path(image_path).read_bytes()
+                except OSError as e:
+                    log.warning(f"Exporting message {record.id} without its image: {e}")
+                    entry["rec"] = _with_image(record, None).raw
+                else:
+                    digest = digest_of_path(image_path) or hashlib.sha256(data).hexdigest()
+                    if digest not in written:
+                        out.write(_line({"image": digest, "data": base64.b64encode(data).decode()}))
+                        written.add(digest)
+                    entry["image"] = digest
+            out.write(_line(entry))
+            count += 1
+    return count
+
+
+def import_queue(path: Path, batch_size: int = IMPORT_BATCH) -> ImportResult:
+    """
+    Load an archive written by export_queue into the queue, in batches that
+    cost one write per shard. Messages already queued (same id) are skipped,
+    so an interrupted import can be repeated. Safe while the service runs.
+    """
+    stored = skipped = images = 0
+    batch: List[QueueRecord] = []
+
+    def flush() -> None:
+        nonlocal stored, skipped
+        if not batch:
+            return
+        # Reference images before the messages exist, so a message printed
+        # right away cannot drop the last reference
+        refs = Counter(digest_of_path(r.image_path) for r in batch if r.image_path)
+        for digest, count in refs.items():
+            if digest:
+                acquire_image(digest, count)
+        done = {r.id for r in store_records(batch)}
+        for record in batch:
+            if record.id in done:
+                continue
+            skipped += 1
+            if record.image_path:
+                release_image(record.image_path)
+        stored += len(done)
+        batch.clear()
+
+    with gzip.open(path, "rt", encoding="utf-8") as f:
+        header = json.loads(f.readline() or "{}")
+        if header.get("format") != ARCHIVE_FORMAT or header.get("version") != ARCHIVE_VERSION:
+            raise ValueError(f"{path} is not a version {ARCHIVE_VERSION} queue archive")
+
+        for line in f:
+            entry = json.loads(line)
+            if "image" in entry and not _DIGEST.fullmatch(entry["image"]):
+                raise ValueError(f"Invalid image digest in archive: {entry['image']!r}")
+            if "data" in entry:
+                target = path_for_digest(entry["image"])
+                if not target.exists():
+                    write_image_data(base64.b64decode(entry["data"]), target)
+                    images += 1
+                continue
+
+            record = QueueRecord(entry["rec"])
+            if digest := entry.get("image"):
+                image_path = str(path_for_digest(digest))
+                if record.image_path != image_path:
+                    # Exported from another image directory or a pre-content-addressing image
+                    record = _with_image(record, image_path)
+            batch.append(record)
+            if len(batch) >= batch_size:
+                flush()
+        flush()
+    return ImportResult(stored, skipped, images)
@@ -1,103 +1,389 @@
-from tinydb import TinyDB, Query
-from tinydb.storages import JSONStorage
-from tinydb.middlewares import CachingMiddleware
-from tinydb_serialization import SerializationMiddleware  # type: ignore
-from tinydb_serialization.serializers import DateTimeSerializer  # type: ignore
 from pathlib import Path
 from contextlib import contextmanager
-from typing import Any, List, Optional, cast
+from typing import TYPE_CHECKING, Any, Dict, Iterable, Iterator, List, Optional, Tuple, cast
 from bin.message import Message, MessageRecord
+from bin.record import QueueRecord, encode_message
+from bin.queue_index import IndexEntry, QueueIndex, QueueStats
+from bin.scheduler import PriorityScheduler
+from bin.images import digest_of_path, path_for_digest
+from bin.settings import SETTINGS
+import logging
 import os
+import threading
+import time
+import uuid
+import zlib
 from filelock import FileLock
 
-DB_PATH = Path("data/db.json")
-DB_LOCK = Path("data/db.lock")
+if TYPE_CHECKING:
+    from tinydb import TinyDB
 
-serialization = SerializationMiddleware(CachingMiddleware(JSONStorage))  # type: ignore
-serialization.register_serializer(DateTimeSerializer(), "TinyDate")
+DB_DIR = Path("data/queue")
+IMAGES_PATH = DB_DIR / "images.json"
+IMAGES_LOCK = DB_DIR / "images.lock"
+# Single-file queue from before sharding, migrated on first use
+LEGACY_DB_PATH = Path("data/db.json")
+LEGACY_DB_LOCK = Path("data/db.lock")
+DEFAULT_SHARDS = 8
+# How often the index looks for shards written by other processes
+REFRESH_INTERVAL_S = 1.0
+
+_middleware: Any = None
+
+_index: Optional[QueueIndex] = None
+_index_lock = threading.Lock()
+_last_refresh = 0.0
+_shard_set: Optional["ShardSet"] = None
+
+
+def _storage() -> Any:
+    # TinyDB is imported on first use, keeping it off the startup path
+    global _middleware
+    if _middleware is None:
+        from tinydb.storages import JSONStorage
+        from tinydb.middlewares import CachingMiddleware
+        from tinydb_serialization import SerializationMiddleware  # type: ignore
+        from tinydb_serialization.serializers import DateTimeSerializer  # type: ignore
+
+        def middleware() -> Any:
+            serialization = SerializationMiddleware(CachingMiddleware(JSONStorage))  # type: ignore
+            serialization.register_serializer(DateTimeSerializer(), "TinyDate")
+            return serialization
+
+        _middleware = middleware
+    # A middleware holds its open storage, so every open database needs its own
+    return _middleware()
+
+
+def _query() -> Any:
+    from tinydb import Query
+
+    return Query()
 
 
 @contextmanager
-def get_db():
-    with FileLock(str(DB_LOCK)):
-        db = TinyDB(DB_PATH, storage=serialization)
+def _open(path: Path, lock: Path) -> Iterator["TinyDB"]:
+    from tinydb import TinyDB
+
+    with FileLock(str(lock)):
+        db = TinyDB(path, storage=_storage())
         try:
             yield db
         finally:
             db.close()
 
 
+class Shard:
+    """One queue file with its own lock."""
+
+    def __init__(self, number: int) -> None:
+        self.number = number
+        self.path = DB_DIR / f"shard-{number:02d}.json"
+        self.lock = DB_DIR / f"shard-{number:02d}.lock"
+        # File version after our last access, to notice writes by other processes
+        self.version: Optional[Tuple[int, int]] = None
+
+    @contextmanager
+    def open(self) -> Iterator["TinyDB"]:
+        from tinydb import TinyDB
+
+        with FileLock(str(self.lock)):
+            # If another process wrote the shard since our last access, keep the
+            # old version so queue_index() notices and reloads it
+            known = self.file_version() == self.version
+            db = TinyDB(self.path, storage=_storage())
+            try:
+                yield db
+            finally:
+                db.close()
+                if known:
+                    self.version = self.file_version()
+
+    def file_version(self) -> Optional[Tuple[int, int]]:
+        try:
+            st = os.stat(self.path)
+        except FileNotFoundError:
+            return None
+        return st.st_mtime_ns, st.st_size
+
+
+class ShardSet:
+    """
+    The queue, split over `count` shard files by a hash of the message id, so
+    intake threads and the worker rarely wait for the same lock. Shard files
+    left from a larger shard count are still read and drained.
+    """
+
+    def __init__(self, count: int) -> None:
+        self.count = max(1, count)
+        existing = [int(p.stem.split("-")[1]) for p in DB_DIR.glob("shard-*.json")]
+        self.shards = [Shard(n) for n in range(max([self.count, *(n + 1 for n in existing)]))]
+
+    def for_id(self, message_id: str) -> Shard:
+        return self.shards[zlib.crc32(message_id.encode()) % self.count]
+
+
+def shard_set() -> ShardSet:
+    global _shard_set
+    with _index_lock:
+        if _shard_set is None:
+            from bin.load import CONFIG
+
+            DB_DIR.mkdir(parents=True, exist_ok=True)
+            _shard_set = ShardSet(int(CONFIG.get("queue", {}).get("shards", DEFAULT_SHARDS)))
+            if LEGACY_DB_PATH.exists():
+                _migrate_legacy_db(_shard_set)
+    return _shard_set
+
+
+def _migrate_legacy_db(shard_set: ShardSet) -> None:
+    with _open(LEGACY_DB_PATH, LEGACY_DB_LOCK) as legacy:
+        for doc in legacy.all():
+            try:
+                record = _to_legacy_record(doc)
+            except Exception as e:
+                # A hand-edited document must not stop the service from starting
+                logging.getLogger(__name__).warning(
+                    f"Skipping legacy message {doc.get('id')}: {e}"
+                )
+                continue
+            # Upserts, so an interrupted migration can simply run again
+            with shard_set.for_id(record.id).open() as db:
+                db.upsert({"id": record.id, "rec": record.raw}, _query().id == record.id)
+        with _open(IMAGES_PATH, IMAGES_LOCK) as images:
+            for doc in legacy.table("images").all():
+                images.upsert(dict(doc), _query().hash == doc["hash"])
+        for rec in legacy.table("settings").all():
+            SETTINGS.set(rec["name"], rec["value"])
+    LEGACY_DB_PATH.rename(LEGACY_DB_PATH.with_suffix(".json.migrated"))
+    for shard in shard_set.shards:
+        shard.version = None  # have the index load the migrated messages
+
+
 def set_message_processing(enabled: bool) -> None:
-    with get_db() as db:
-        settings = db.table("settings")
-        settings.upsert(
-            {"name": "message_processing", "value": enabled},
-            Query().name == "message_processing",
-        )
+    SETTINGS.set("message_processing", enabled)
 
 
 def get_message_processing() -> bool:
-    """Return current flag (default True if not yet set)."""
-    with get_db() as db:
-        settings = db.table("settings")
-        rec = settings.get(Query().name == "message_processing")
-        return bool(rec["value"]) if rec else True   # type: ignore[attr-defined]
+    """Return current flag (default True if not yet set). Reads take no lock."""
+    return bool(SETTINGS.get("message_processing", True))
+
+
+def _to_record(doc: dict[str, Any]) -> QueueRecord:
+    if "rec" in doc:
+        return QueueRecord(doc["rec"])
+    # Documents written before the compact record format
+    return QueueRecord(encode_message(Message.from_dict(cast(MessageRecord, doc))))
+
+
+def _to_legacy_record(doc: dict[str, Any]) -> QueueRecord:
+    if "rec" not in doc:
+        try:
+            uuid.UUID(str(doc.get("id")))
+        except ValueError:
+            doc = {**doc, "id": str(uuid.uuid4())}
+    return _to_record(doc)
+
+
+def queue_index() -> QueueIndex:
+    """
+    Return the in-memory queue index, building it from the shards on first
+    use and re-reading any shard another process has written since.
+    """
+    global _index, _last_refresh
+    shard_set_ = shard_set()
+    with _index_lock:
+        if _index is None:
+            _index = QueueIndex()
+            _last_refresh = 0.0
+        index = _index
+        if time.monotonic() - _last_refresh < REFRESH_INTERVAL_S:
+            return index
+        _last_refresh = time.monotonic()
+
+    for shard in shard_set_.shards:
+        if shard.file_version() != shard.version:
+            _reload_shard(index, shard)
+    return index
+
+
+def _reload_shard(index: QueueIndex, shard: Shard) -> None:
+    # Under the shard lock, so no write to this shard can slip in between
+    with shard.open() as db:
+        index.replace_shard(
+            shard.number, ((doc.doc_id, _to_record(doc)) for doc in db.all())
+        )
+        shard.version = shard.file_version()
 
 
 def store_message(raw: dict[str, Any]) -> str:
     msg = Message.from_dict(raw)
-    with get_db() as db:
-        db.insert(msg.to_record())  # type: ignore[arg-type]
+    index = queue_index()
+    rec = encode_message(msg)
+    shard = shard_set().for_id(msg.id)
+    with shard.open() as db:
+        doc_id = db.insert({"id": msg.id, "rec": rec})
+        index.add(shard.number, doc_id, QueueRecord(rec))
     return msg.id
 
 
+def _shards_for(message_id: str) -> List[Shard]:
+    """The shard holding a message first, then the rest (for unindexed ids)."""
+    entry = queue_index().get(message_id)
+    shard_set_ = shard_set()
+    first = shard_set_.shards[entry.shard] if entry else shard_set_.for_id(message_id)
+    return [first] + [s for s in shard_set_.shards if s is not first]
+
+
+def store_records(records: Iterable[QueueRecord]) -> List[QueueRecord]:
+    """
+    Bulk-insert encoded records, one write per shard. Records whose id is
+    already queued are skipped. Returns the records that were stored.
+    """
+    index = queue_index()
+    shard_set_ = shard_set()
+    by_shard: Dict[int, List[QueueRecord]] = {}
+    for record in records:
+        if record.id not in index:
+            by_shard.setdefault(shard_set_.for_id(record.id).number, []).append(record)
+
+    stored: List[QueueRecord] = []
+    for number, batch in by_shard.items():
+        shard = shard_set_.shards[number]
+        with shard.open() as db:
+            present = {doc["id"] for doc in db.all()}
+            batch = [r for r in batch if r.id not in present]
+            doc_ids = db.insert_multiple({"id": r.id, "rec": r.raw} for r in batch)
+            for doc_id, record in zip(doc_ids, batch):
+                index.add(number, doc_id, record)
+        stored.extend(batch)
+    return stored
+
+
+def iter_records() -> Iterator[QueueRecord]:
+    """
+    Yield every queued record, one shard at a time. Each shard is copied
+    under its lock and yielded after the lock is released, so a slow consumer
+    does not hold up the service.
+    """
+    for shard in shard_set().shards:
+        with shard.open() as db:
+            records = [_to_record(doc) for doc in db.all()]
+        yield from records
+
+
 def load_message_by_id(message_id: str) -> Optional[Message]:
-    with get_db() as db:
-        record: Optional[MessageRecord] = db.get(Query().id == message_id)  # type: ignore[assignment]
-        return Message.from_dict(record) if record else None
+    for shard in _shards_for(message_id):
+        with shard.open() as db:
+            doc = db.get(_query().id == message_id)
+        if doc:
+            return _to_record(doc).to_message()  # type: ignore[arg-type]
+    return None
+
 
+def load_all_messages() -> List[QueueRecord]:
+    return list(iter_records())
 
-def load_all_messages():
-    with get_db() as db:
-        return db.all()
+
+def count_messages() -> int:
+    return len(queue_index())
+
+
+def queue_stats() -> QueueStats:
+    return queue_index().stats()
+
+
+def queued_with_idempotency_keys() -> List[IndexEntry]:
+    return queue_index().with_idempotency_keys()
 
 
 def drop_all_messages():
-    with get_db() as db:
-        db.truncate()
+    index = queue_index()
+    for shard in shard_set().shards:
+        with shard.open() as db:
+            image_paths = [_to_record(doc).image_path for doc in db.all()]
+            db.truncate()
+            index.replace_shard(shard.number, [])
+        for image_path in image_paths:
+            if image_path:
+                release_image(image_path)
 
 
-def delete_message_by_id(message_id: str) -> None:
-    with get_db() as db:
-        rec: Optional[MessageRecord] = cast(
-            Optional[MessageRecord], db.get(Query().id == message_id)
-        )
+def _remove_file(path: str) -> None:
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+    except Exception as exc:
+        print(f"Warning: could not delete image {path}: {exc}")
 
-        image_path = rec.get("image_path") if rec else None  # type: ignore[attr-defined]
 
-        if image_path:
-            try:
-                os.remove(image_path)
-            except FileNotFoundError:
-                pass
-            except Exception as exc:
-                print(f"Warning: could not delete image {image_path}: {exc}")
+def acquire_image(digest: str, count: int = 1) -> bool:
+    """
+    Take `count` references on a content-addressed image. Returns True if the
+    image file does not exist yet and the caller has to write it.
+    """
+    with _open(IMAGES_PATH, IMAGES_LOCK) as db:
+        rec = db.get(_query().hash == digest)
+        refs = rec["refs"] if rec else 0  # type: ignore[index]
+        db.upsert({"hash": digest, "refs": refs + count}, _query().hash == digest)
+        return not path_for_digest(digest).exists()
 
-        db.remove(Query().id == message_id)
 
+def release_image(image_path: str) -> None:
+    """Drop a reference on an image, deleting the file when none are left."""
+    digest = digest_of_path(image_path)
+    if digest is None:
+        # Per-message image from before content addressing
+        _remove_file(image_path)
+        return
 
-def load_oldest_message() -> Optional[MessageRecord]:
-    with get_db() as db:
-        msgs: List[MessageRecord] = db.all()  # type: ignore
-        if not msgs:
-            return None
+    with _open(IMAGES_PATH, IMAGES_LOCK) as db:
+        rec = db.get(_query().hash == digest)
+        refs = rec["refs"] - 1 if rec else 0  # type: ignore[index]
+        if refs > 0:
+            db.update({"refs": refs}, _query().hash == digest)
+        else:
+            db.remove(_query().hash == digest)
+            _remove_file(image_path)
+
+
+def delete_message_by_id(message_id: str) -> None:
+    index = queue_index()
+    for shard in _shards_for(message_id):
+        with shard.open() as db:
+            doc = db.get(_query().id == message_id)
+            if doc:
+                db.remove(_query().id == message_id)
+            index.remove(message_id)
+        if doc:
+            if image_path := _to_record(doc).image_path:  # type: ignore[arg-type]
+                release_image(image_path)
+            return
 
-        with_dt = [m for m in msgs if m.get("dt_received") is not None]
-        without_dt = [m for m in msgs if m.get("dt_received") is None]
 
-        if with_dt:
-            return sorted(
-                with_dt,
-                key=lambda m: m.get("dt_received") or "",
-            )[0]
-        return sorted(without_dt, key=lambda m: str(m.get("id", "")))[0]
+def load_oldest_message() -> Optional[QueueRecord]:
+    records = load_all_messages()
+    if not records:
+        return None
+
+    # Records without a receive time sort after everything else, by id
+    return min(
+        records,
+        key=lambda r: (r.received_us == 0, r.received_us, r.id),
+    )
+
+
+def load_next_message(scheduler: PriorityScheduler) -> Optional[QueueRecord]:
+    """Load the message the scheduler picks from the queue index."""
+    index = queue_index()
+    entry: Optional[IndexEntry] = scheduler.pick(index)
+    if entry is None:
+        return None
+    with shard_set().shards[entry.shard].open() as db:
+        doc = db.get(doc_id=entry.doc_id)
+        if doc is None or doc.get("id") != entry.id:
+            # Removed behind our back; forget it and let the caller try again
+            index.remove(entry.id)
+            return None
+    return _to_record(doc)  # type: ignore[arg-type]
@@ -0,0 +1,72 @@
+import hashlib
+import json
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Iterable, Optional, Tuple
+
+
+def job_key(printkey: Optional[str], data: Dict[str, Any], identical_jobs: bool) -> Optional[str]:
+    """
+    Key under which a submitted job is deduplicated: the client's idempotency
+    key if given, otherwise (when enabled) a hash of the job's content.
+    """
+    if key := data.get("idempotency_key"):
+        return idempotency_job_key(printkey, key)
+    if not identical_jobs:
+        return None
+    scope = printkey or ""
+    content = json.dumps(
+        [data.get(k) for k in ("sender", "text", "image", "custom_template", "priority")]
+    )
+    return f"{scope}:job:{hashlib.sha256(content.encode()).hexdigest()}"
+
+
+def idempotency_job_key(printkey: Optional[str], idempotency_key: str) -> str:
+    return f"{printkey or ''}:key:{idempotency_key}"
+
+
+class RecentJobs:
+    """
+    Remembers job keys for a while, so a retried submission is stored once.
+
+    `initial` returns (key, message_id, ttl) for keys to remember from the
+    start, oldest first; it is called on the first claim, so keys of jobs
+    still queued from before a restart are not forgotten.
+    """
+
+    def __init__(
+        self, initial: Optional[Callable[[], Iterable[Tuple[str, str, float]]]] = None
+    ) -> None:
+        self.initial = initial
+        self._keys: "OrderedDict[str, Tuple[str, float]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def claim(self, key: str, message_id: str, ttl: float) -> Optional[str]:
+        """
+        Claim `key` for `message_id`. Returns the id of the message that already
+        holds the key, or None if the claim succeeded.
+        """
+        now = time.monotonic()
+        with self._lock:
+            if self.initial:
+                for seeded_key, seeded_id, seeded_ttl in self.initial():
+                    if seeded_ttl > 0:
+                        self._keys[seeded_key] = (seeded_id, now + seeded_ttl)
+                self.initial = None
+
+            # Keys are inserted with the same ttl, so the oldest expire first
+            while self._keys:
+                oldest_key, (_, expires) = next(iter(self._keys.items()))
+                if expires > now:
+                    break
+                del self._keys[oldest_key]
+
+            if key in self._keys:
+                return self._keys[key][0]
+            self._keys[key] = (message_id, now + ttl)
+            return None
+
+    def release(self, key: str) -> None:
+        with self._lock:
+            self._keys.pop(key, None)
@@ -0,0 +1,100 @@
+import json
+import threading
+from datetime import date, datetime, timedelta
+from pathlib import Path
+from typing import Any, Dict, Iterator, Optional, Tuple
+from bin.db import acquire_image, release_image
+from bin.images import digest_of_path
+from bin.logger import logging
+from bin.record import QueueRecord
+
+HISTORY_DIR = Path("data/history")
+
+
+class JobHistory:
+    """
+    Append-only log of finished jobs, one JSON line per job in a file per day
+    (data/history/YYYY-MM-DD.jsonl), kept for `retention_days`.
+
+    A job's image stays referenced while the job is in the history, so old
+    jobs can be replayed with their images.
+    """
+
+    def __init__(self, directory: Path = HISTORY_DIR, retention_days: int = 7) -> None:
+        self.directory = directory
+        self.retention_days = retention_days
+        self._lock = threading.Lock()
+        self._pruned: Optional[date] = None
+
+    @classmethod
+    def from_config(cls, config: Dict[str, Any]) -> Optional["JobHistory"]:
+        history = config.get("history", {})
+        if not history.get("enabled", True):
+            return None
+        return cls(retention_days=history.get("retention_days", 7))
+
+    def path_for(self, day: date) -> Path:
+        return self.directory / f"{day.isoformat()}.jsonl"
+
+    def record(self, record: QueueRecord, status: str, finished: Optional[datetime] = None) -> None:
+        """Log a finished job; call before the job is deleted from the queue."""
+        finished = finished or datetime.now()
+        if image_path := record.image_path:
+            if digest := digest_of_path(image_path):
+                acquire_image(digest)
+        line = json.dumps(
+            {"finished": finished.isoformat(), "status": status, "rec": record.raw},
+            separators=(",", ":"),
+        )
+        with self._lock:
+            self.directory.mkdir(parents=True, exist_ok=True)
+            with open(self.path_for(finished.date()), "a", encoding="utf-8") as f:
+                f.write(line + "\n")
+        if self._pruned != finished.date():
+            self.prune(finished.date())
+
+    def between(
+        self, start: datetime, end: datetime
+    ) -> Iterator[Tuple[datetime, str, QueueRecord]]:
+        """Yield (finished, status, record) for jobs finished in [start, end), oldest first."""
+        day = start.date()
+        while day <= end.date():
+            for finished, status, record in self._read(self.path_for(day)):
+                if start <= finished < end:
+                    yield finished, status, record
+            day += timedelta(days=1)
+
+    def prune(self, today: Optional[date] = None) -> None:
+        """Delete days older than the retention period and release their images."""
+        today = today or date.today()
+        self._pruned = today
+        cutoff = today - timedelta(days=self.retention_days)
+        for path in sorted(self.directory.glob("*.jsonl")):
+            try:
+                day = date.fromisoformat(path.stem)
+            except ValueError:
+                continue
+            if day >= cutoff:
+                break
+            for _, _, record in self._read(path):
+                if image_path := record.image_path:
+                    release_image(image_path)
+            path.unlink()
+            logging.getLogger(__name__).info(f"Pruned job history {path.name}")
+
+    @staticmethod
+    def _read(path: Path) -> Iterator[Tuple[datetime, str, QueueRecord]]:
+        try:
+            f = open(path, encoding="utf-8")
+        except FileNotFoundError:
+            return
+        with f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                    finished = datetime.fromisoformat(entry["finished"])
+                    record = QueueRecord(entry["rec"])
+                except (ValueError, KeyError):
+                    # A line still being appended by the running service
+                    continue
+                yield finished, entry["status"], record
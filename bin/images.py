@@ -0,0 +1,72 @@
+import hashlib
+import json
+import os
+from io import BytesIO
+from pathlib import Path
+from typing import TYPE_CHECKING, Any, Dict, Optional
+
+if TYPE_CHECKING:
+    from PIL import Image
+
+IMAGE_STORE_DIR = Path("data/img/store")
+IMAGE_STORE_DIR.mkdir(parents=True, exist_ok=True)
+
+
+def image_digest(image_data: bytes, config: Dict[str, Any]) -> str:
+    """
+    Content address of a processed image: the source bytes plus every setting
+    that changes how they are processed.
+    """
+    h = hashlib.sha256(json.dumps(config, sort_keys=True).encode())
+    h.update(image_data)
+    return h.hexdigest()
+
+
+def path_for_digest(digest: str) -> Path:
+    return IMAGE_STORE_DIR / f"{digest}.png"
+
+
+def digest_of_path(path: str) -> Optional[str]:
+    """Return the digest of a content-addressed image path, None for other paths."""
+    p = Path(path)
+    if p.parent != IMAGE_STORE_DIR or p.suffix != ".png":
+        return None
+    return p.stem
+
+
+def process_image(image_data: bytes, config: Dict[str, Any]) -> "Image.Image":
+    """Flatten, rotate and resize an image, then dither it to 1-bit for printing."""
+    from PIL import Image
+
+    max_width = config["max_width"]
+
+    image = Image.open(BytesIO(image_data))
+
+    image = image.convert("RGBA")
+    background = Image.new("RGBA", image.size, "WHITE")
+    background.alpha_composite(image)
+
+    image = background.convert("RGB").rotate(config["rotate"], expand=True)
+    if (
+        config["rotate_to_fit"]
+        and image.width > config["rotate_to_fit_threshold_factor"] * image.height
+    ):
+        image = image.rotate(90, expand=True)
+    new_height = int(max_width * image.height / image.width)
+    image = image.resize((max_width, new_height))
+    return image.convert("1")
+
+
+def write_image(image: "Image.Image", path: Path) -> None:
+    # Write then rename, so concurrent writers of the same digest never expose
+    # a half-written file.
+    tmp = path.with_name(f"{path.stem}.{os.getpid()}.{id(image)}.tmp")
+    image.save(tmp, "PNG")
+    os.replace(tmp, path)
+
+
+def write_image_data(data: bytes, path: Path) -> None:
+    """Write already-processed image bytes (e.g. from an archive) the same way."""
+    tmp = path.with_name(f"{path.stem}.{os.getpid()}.{id(data)}.tmp")
+    tmp.write_bytes(data)
+    os.replace(tmp, path)
@@ -1,13 +1,17 @@
-import yaml
 from pathlib import Path
-from typing import Any, Dict, List
+from typing import Any, Dict, Iterator, List, Mapping, Optional
 import importlib
+import logging
+import threading
+from bin.ratelimit import parse_rate_limit
 
 CONFIG_PATH = "config/config.yaml"
 PRINTKEYS_PATH = "data/printkeys"
 
 
 def load_yaml(path: str | Path) -> dict[str, Any]:
+    import yaml
+
     path = Path(path)
 
     if not path.is_file():
@@ -22,11 +26,13 @@ def load_yaml(path: str | Path) -> dict[str, Any]:
 
 def load_named_api_keys(folder: str = "data/printkeys") -> Dict[str, dict]:
     """
-    Returns {key_name: {"key": api_key, "permissions": [str, ...]}, ...}
+    Returns {key_name: {"key": api_key, "permissions": [str, ...],
+                        "rate_limit": {...} | None}, ...}
 
     Each .txt file:
         line 1 → the key
         line 2 → optional comma-separated list of permissions
+        line 3 → optional rate limit: <messages per minute>[,<burst>]
     """
     result: Dict[str, dict] = {}
     for f in Path(folder).glob("*.txt"):
@@ -35,7 +41,13 @@ def load_named_api_keys(folder: str = "data/printkeys") -> Dict[str, dict]:
             continue
         api_key = lines[0].strip()
         perms   = [p.strip() for p in lines[1].split(",")] if len(lines) > 1 else []
-        result[f.stem] = {"key": api_key, "permissions": perms}
+        try:
+            rate = parse_rate_limit(lines[2]) if len(lines) > 2 else None
+        except ValueError as e:
+            # Skipped rather than left unlimited; the other keys keep working
+            logging.getLogger(__name__).error(f"Ignoring printkey {f.name}: bad rate limit: {e}")
+            continue
+        result[f.stem] = {"key": api_key, "permissions": perms, "rate_limit": rate}
     return result
 
 
@@ -48,4 +60,29 @@ def load_template_by_name(name: str):
         return None
 
 
-CONFIG = load_yaml(CONFIG_PATH)
+class LazyConfig(Mapping[str, Any]):
+    """The YAML config, read from disk the first time a key is looked up."""
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        self._data: Optional[dict[str, Any]] = None
+        self._lock = threading.Lock()
+
+    def _load(self) -> dict[str, Any]:
+        if self._data is None:
+            with self._lock:
+                if self._data is None:
+                    self._data = load_yaml(self.path)
+        return self._data
+
+    def __getitem__(self, key: str) -> Any:
+        return self._load()[key]
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self._load())
+
+    def __len__(self) -> int:
+        return len(self._load())
+
+
+CONFIG = LazyConfig(CONFIG_PATH)
@@ -1,8 +1,10 @@
 import logging
 from logging.handlers import RotatingFileHandler
 from pathlib import Path
+from contextlib import contextmanager
 from datetime import datetime
-from typing import Callable, List
+from time import perf_counter
+from typing import Callable, Iterator, List, Tuple
 from bin.load import CONFIG
 
 LOG_DIR = Path("data/logs")
@@ -75,3 +77,30 @@ def setup_logging():
     )
 
     logging.getLogger(__name__).info(f"Logging initialized at level {log_level}")
+
+
+class PhaseTimer:
+    """Logs how long each startup phase takes, and a summary once done."""
+
+    def __init__(self) -> None:
+        self.started = perf_counter()
+        self.phases: List[Tuple[str, float]] = []
+
+    @contextmanager
+    def phase(self, name: str) -> Iterator[None]:
+        t = perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = perf_counter() - t
+            self.phases.append((name, elapsed))
+            logging.getLogger(__name__).info(
+                f"Startup phase '{name}' took {elapsed * 1000:.0f} ms"
+            )
+
+    def done(self) -> None:
+        total = perf_counter() - self.started
+        phases = ", ".join(f"{n}: {t * 1000:.0f} ms" for n, t in self.phases)
+        logging.getLogger(__name__).info(
+            f"Startup complete in {total * 1000:.0f} ms ({phases})"
+        )
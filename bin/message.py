@@ -20,6 +20,9 @@ class MessageRecord(TypedDict, total=False):
     sender: str
     cut: bool
     custom_template: str
+    printkey: str
+    priority: int
+    idempotency_key: str
 
 
 @dataclass(slots=True)
@@ -33,6 +36,9 @@ class Message:
     sender: Optional[str] = None
     cut: bool = True
     custom_template: Optional[str] = None
+    printkey: Optional[str] = None
+    priority: int = 0
+    idempotency_key: Optional[str] = None
 
     def to_record(self) -> dict[str, Any]:
         raw: dict[str, Any] = asdict(self)
@@ -66,4 +72,7 @@ class Message:
             sender=data.get("sender") or None,
             cut=bool(data.get("cut", True)),
             custom_template=data.get("custom_template") or None,
+            printkey=data.get("printkey") or None,
+            priority=int(data.get("priority") or 0),
+            idempotency_key=data.get("idempotency_key") or None,
         )
@@ -0,0 +1,128 @@
+import threading
+from socketserver import ThreadingMixIn
+from typing import Any, Callable, Dict, List, Optional
+from wsgiref.simple_server import WSGIRequestHandler, WSGIServer, make_server
+
+
+class LazyMetric:
+    """
+    Prometheus metric that is only created (and prometheus_client only
+    imported) the first time it is used.
+    """
+
+    _lock = threading.Lock()
+    _all: List["LazyMetric"] = []
+
+    def __init__(self, kind: str, name: str, documentation: str, **kw: Any) -> None:
+        self.kind, self.name, self.documentation, self.kw = kind, name, documentation, kw
+        self._metric: Optional[Any] = None
+        LazyMetric._all.append(self)
+
+    def _get(self) -> Any:
+        if self._metric is None:
+            with LazyMetric._lock:
+                if self._metric is None:
+                    import prometheus_client
+
+                    cls = getattr(prometheus_client, self.kind)
+                    self._metric = cls(self.name, self.documentation, **self.kw)
+        return self._metric
+
+    def __getattr__(self, attr: str) -> Any:
+        return getattr(self._get(), attr)
+
+
+class _ThreadingWSGIServer(ThreadingMixIn, WSGIServer):
+    daemon_threads = True
+
+
+class _QuietHandler(WSGIRequestHandler):
+    def log_message(self, format: str, *args: Any) -> None:
+        pass
+
+
+def _loopback(environ: Dict[str, Any]) -> bool:
+    address = environ.get("REMOTE_ADDR", "")
+    return address == "::1" or address.startswith("127.")
+
+
+def start_metrics_server(port: int, debug_app: Optional[Callable[..., Any]] = None) -> None:
+    """
+    Serve /metrics on `port`, and requests under /debug/ with `debug_app`
+    if given (see bin.profiler). The debug endpoints take no API key, so
+    they only answer clients on this machine.
+    """
+    from prometheus_client import make_wsgi_app
+
+    # Create every metric up front, so unused ones are still exported as 0
+    for metric in LazyMetric._all:
+        metric._get()
+    metrics_app = make_wsgi_app()
+
+    def app(environ: Dict[str, Any], start_response: Callable[..., Any]) -> Any:
+        if debug_app and environ.get("PATH_INFO", "").startswith("/debug/"):
+            if not _loopback(environ):
+                start_response("403 Forbidden", [("Content-Type", "text/plain; charset=utf-8")])
+                return [b"Debug endpoints are only served to localhost.\n"]
+            return debug_app(environ, start_response)
+        return metrics_app(environ, start_response)
+
+    server = make_server("0.0.0.0", port, app, _ThreadingWSGIServer, handler_class=_QuietHandler)
+    threading.Thread(target=server.serve_forever, name="metrics", daemon=True).start()
+
+
+PRINTER_UP = LazyMetric("Gauge", "printer_server_up", "1 = server main loop running")
+PRINTER_ERRORS = LazyMetric(
+    "Counter", "printer_server_errors_total", "Total unhandled server errors"
+)
+PRINTER_QUEUE_SIZE = LazyMetric(
+    "Gauge", "printer_server_queue_length", "Current number of unprocessed messages"
+)
+PRINTER_RATE_LIMITED = LazyMetric(
+    "Counter",
+    "printer_server_rate_limited_total",
+    "Messages rejected by printkey rate limits",
+)
+PRINTER_DUPLICATES = LazyMetric(
+    "Counter",
+    "printer_server_duplicate_messages_total",
+    "Retried messages that were not stored again",
+)
+PRINTER_QUEUE_ETA = LazyMetric(
+    "Gauge",
+    "printer_server_queue_eta_seconds",
+    "Estimated time to print the current queue",
+)
+PRINTER_REJECTED = LazyMetric(
+    "Counter",
+    "printer_server_busy_rejections_total",
+    "Messages rejected by admission control",
+)
+PRINTER_DEGRADED = LazyMetric(
+    "Counter",
+    "printer_server_images_dropped_total",
+    "Images dropped from messages under load",
+)
+PRINTER_IMAGE_DEDUPED = LazyMetric(
+    "Counter",
+    "printer_server_image_dedup_hits_total",
+    "Images reused from the content store",
+)
+PRINTER_STATE = LazyMetric(
+    "Enum",
+    "printer_state",
+    "Connection state of the printer",
+    states=["connecting", "ready", "reconnecting"],
+)
+PRINTER_RECONNECTS = LazyMetric(
+    "Counter", "printer_reconnects_total", "Printer reconnects after errors"
+)
+PRINTER_JOB_RETRIES = LazyMetric(
+    "Counter", "printer_job_retries_total", "Print jobs resumed after an error"
+)
+PRINTER_JOBS_FAILED = LazyMetric(
+    "Counter", "printer_jobs_failed_total", "Print jobs dropped after too many attempts"
+)
+PRINTER_JOBS_PRINTED = LazyMetric(
+    "Counter", "printer_jobs_printed_total", "Print jobs completed"
+)
@@ -0,0 +1,190 @@
+import codecs
+from typing import Dict, Iterable, List, Optional, Tuple
+from bin.logger import logging
+
+ESC_T = b"\x1bt"
+REPLACEMENT = ord("?")
+
+
+def python_codec(name: str) -> Optional[str]:
+    """Map a printer profile code page name (CP858, WPC1252, ISO_8859-7) to a codec."""
+    candidate = name.lower().replace("_", "-")
+    if candidate.startswith("wpc"):
+        candidate = "cp" + candidate[3:]
+    try:
+        return codecs.lookup(candidate).name
+    except LookupError:
+        return None
+
+
+def single_byte(codec: str) -> bool:
+    """True for codecs where every character is one byte (not CP932 and the like)."""
+    chars = bytes(range(0x80, 0x100)).decode(codec, errors="ignore")
+    return all(len(ch.encode(codec)) == 1 for ch in chars)
+
+
+def profile_code_pages(profile: str) -> Optional[Dict[str, int]]:
+    """{name: ESC t index} from a python-escpos printer profile, or None if unknown."""
+    try:
+        from escpos.capabilities import get_profile  # type: ignore
+
+        return {n: int(i) for n, i in get_profile(profile).get_code_pages().items()}
+    except Exception as e:
+        logging.getLogger(__name__).warning(f"No code pages for printer profile {profile}: {e}")
+        return None
+
+
+def resolve_pages(
+    profile_pages: Dict[str, int], charcode: str, preferred: Optional[List[str]] = None
+) -> List[Tuple[str, int]]:
+    """
+    The code pages to print with, as (name, ESC t index): `charcode` first,
+    then `preferred` (by default every page of the profile), keeping only
+    pages the profile has and that map to a single-byte Python codec.
+    Configured pages that are dropped are logged.
+    """
+    log = logging.getLogger(__name__)
+    names = [charcode] + [n for n in (preferred or profile_pages) if n != charcode]
+    pages: List[Tuple[str, int]] = []
+    for name in names:
+        configured = name == charcode or preferred is not None
+        if name not in profile_pages:
+            if configured:
+                log.warning(f"Code page {name} is not in the printer profile; not using it")
+            continue
+        codec = python_codec(name)
+        if codec is None or not single_byte(codec):
+            if configured:
+                log.warning(f"Code page {name} has no single-byte codec; not using it")
+            continue
+        pages.append((name, int(profile_pages[name])))
+    return pages
+
+
+def build_table(codec: str) -> Dict[str, int]:
+    """Character -> byte for the upper half of a single-byte code page."""
+    table: Dict[str, int] = {}
+    for byte in range(0x80, 0x100):
+        try:
+            ch = bytes([byte]).decode(codec)
+        except UnicodeDecodeError:
+            continue
+        table.setdefault(ch, byte)
+    return table
+
+
+class CodePageEncoder:
+    """
+    Encodes text for the printer, switching code pages (ESC t n) when a
+    character is not in the current one.
+
+    Pages are tried in the given order, so the configured charcode wins ties.
+    Encode tables are built on first use per page and the page for each
+    non-ASCII character is cached, so encoding costs O(1) per character.
+    A switch is only emitted when the page actually changes; the encoder
+    tracks the printer's current page across calls.
+    """
+
+    def __init__(self, pages: Iterable[Tuple[str, int]], current: Optional[str] = None) -> None:
+        self.pages: List[Tuple[str, int, str]] = []
+        for name, index in pages:
+            codec = python_codec(name)
+            if codec is not None and all(codec != c for _, _, c in self.pages):
+                self.pages.append((name, index, codec))
+        self._tables: Dict[int, Dict[str, int]] = {}
+        self._page_of: Dict[str, Optional[int]] = {}
+        self.current = next(
+            (i for i, (name, _, _) in enumerate(self.pages) if name == current), 0
+        )
+
+    @classmethod
+    def for_profile(
+        cls, profile_pages: Dict[str, int], charcode: str, preferred: Optional[List[str]] = None
+    ) -> "CodePageEncoder":
+        """
+        Build an encoder from a python-escpos profile's code pages
+        ({name: ESC t index}), limited to and ordered by `preferred` if given
+        (see resolve_pages). If the profile lacks `charcode`, the first
+        resolved page becomes the current one; send select() to switch the
+        printer to it.
+        """
+        pages = resolve_pages(profile_pages, charcode, preferred)
+        if pages and pages[0][0] != charcode:
+            logging.getLogger(__name__).warning(f"Using code page {pages[0][0]} instead of {charcode}")
+        return cls(pages, pages[0][0] if pages else charcode)
+
+    def select(self) -> bytes:
+        """ESC t for the current page, to put the printer on the page the encoder assumes."""
+        if not self.pages:
+            return b""
+        return ESC_T + bytes([self.pages[self.current][1]])
+
+    def table(self, page: int) -> Dict[str, int]:
+        table = self._tables.get(page)
+        if table is None:
+            table = self._tables[page] = build_table(self.pages[page][2])
+        return table
+
+    def page_of(self, ch: str) -> Optional[int]:
+        if ch not in self._page_of:
+            self._page_of[ch] = next(
+                (p for p in range(len(self.pages)) if ch in self.table(p)), None
+            )
+        return self._page_of[ch]
+
+    def encode(self, text: str) -> bytes:
+        if text.isascii() or not self.pages:
+            return text.encode("ascii", errors="replace")
+        try:
+            # Common case: everything fits the current page, encode in C
+            return text.encode(self.pages[self.current][2])
+        except UnicodeEncodeError:
+            pass
+
+        out = bytearray()
+        current = self.current
+        table = self.table(current)
+        for ch in text:
+            if ch < "\x80":
+                out.append(ord(ch))
+                continue
+            byte = table.get(ch)
+            if byte is None:
+                page = self.page_of(ch)
+                if page is None:
+                    out.append(REPLACEMENT)
+                    continue
+                current = page
+                table = self.table(page)
+                out += ESC_T + bytes([self.pages[page][1]])
+                byte = table[ch]
+            out.append(byte)
+        self.current = current
+        return bytes(out)
+
+
+def benchmark(repeat: int = 2000) -> None:
+    """Compare against the plain CP858 encode on typical inputs."""
+    import timeit
+    from bin.utils import encode_cp858
+
+    encoder = CodePageEncoder([("CP858", 19), ("CP866", 17), ("CP852", 18)], "CP858")
+    samples = {
+        "ascii": "Hello from the printer, order #1234 is ready! " * 4,
+        "latin": "Café crème, naïve façade, jalapeño, smørrebrød. " * 4,
+        "cyrillic": "Привет из принтера, заказ готов. " * 4,
+        "mixed": "Zażółć gęślą jaźń / Привет / Grüße " * 4,
+    }
+    for name, text in samples.items():
+        base = timeit.timeit(lambda: encode_cp858(text), number=repeat)
+        new = timeit.timeit(lambda: encoder.encode(text), number=repeat)
+        unprinted = encoder.encode(text).count(REPLACEMENT) - text.count("?")
+        print(
+            f"{name:9} cp858: {base / repeat * 1e6:7.2f} us  "
+            f"code pages: {new / repeat * 1e6:7.2f} us  "
+            f"('?' cp858: {encode_cp858(text).count(REPLACEMENT)}, code pages: {unprinted})"
+        )
+
+
+if __name__ == "__main__":
+    benchmark()
@@ -0,0 +1,161 @@
+import math
+import re
+import unicodedata
+from functools import lru_cache
+from typing import Any, Dict, List
+from config.style import DEFAULT_STYLE
+from .tokens.tokens import Token, TextToken, StyledToken, TableToken, merged_style
+
+_PIECES = re.compile(r"\n|[ ]+|[^ \n]+")
+
+
+@lru_cache(maxsize=8192)
+def text_width(text: str) -> int:
+    """Width of `text` in character cells; wide (CJK) characters take two."""
+    if text.isascii():
+        return len(text)
+    width = 0
+    for ch in text:
+        if unicodedata.combining(ch):
+            continue
+        width += 2 if unicodedata.east_asian_width(ch) in ("W", "F") else 1
+    return width
+
+
+class LineLayout:
+    """
+    Word wrapping for the printer's paper width.
+
+    Tracks the print position across tokens, in units that fit every font's
+    column count exactly, and replaces the space before a word that would not
+    fit with a line break, so words are never split by the printer. A line
+    break is only added where there is no space to replace, such as a word
+    right after a style change. Text inside <table> is laid out in aligned
+    columns, padded with spaces.
+    """
+
+    def __init__(self, columns: Dict[str, int]) -> None:
+        self.columns = columns
+        self.line = math.lcm(*columns.values())
+        self.col = 0
+
+    def newline(self) -> None:
+        self.col = 0
+
+    def char_units(self, style: Dict[str, Any]) -> int:
+        columns = self.columns.get(style["font"]) or min(self.columns.values())
+        return _char_units(self.line, columns, style["width"] or 1)
+
+    def flow(
+        self, tokens: List[Token], style: Dict[str, Any] = DEFAULT_STYLE
+    ) -> List[Token]:
+        for tok in tokens:
+            if (
+                isinstance(tok, TableToken)
+                and tok.children
+                and all(isinstance(c, TextToken) for c in tok.children)
+            ):
+                self.table(tok, merged_style(style, **tok._local_overrides()))
+            elif isinstance(tok, StyledToken):
+                overrides = tok._local_overrides()
+                self.flow(tok.children, merged_style(style, **overrides))
+                if "align" in overrides:
+                    # render_ctx ends aligned blocks with a line break
+                    self.newline()
+            elif isinstance(tok, TextToken):
+                tok.text = self.wrap(tok.text, style)
+        return tokens
+
+    def wrap(self, text: str, style: Dict[str, Any] = DEFAULT_STYLE) -> str:
+        cw = self.char_units(style)
+        out: List[str] = []
+        pending = ""
+        for piece in _PIECES.findall(text):
+            if piece == "\n":
+                out.append("\n")
+                pending = ""
+                self.col = 0
+                continue
+            if piece[0] == " ":
+                pending = piece
+                continue
+
+            gap = len(pending) * cw
+            width = text_width(piece) * cw
+            if self.col + gap + width <= self.line:
+                out.append(pending + piece)
+                self.col += gap + width
+            elif width <= self.line:
+                out.append(piece if self.col == 0 else "\n" + piece)
+                self.col = width
+            else:
+                # Longer than a line: the printer has to break it anyway
+                out.append(pending + piece)
+                self.col = self._advance(self.col, pending + piece, cw)
+            pending = ""
+
+        if pending:
+            gap = len(pending) * cw
+            if self.col + gap <= self.line:
+                out.append(pending)
+                self.col += gap
+            else:
+                out.append("\n")
+                self.col = 0
+        return "".join(out)
+
+    def table(self, tok: TableToken, style: Dict[str, Any]) -> None:
+        text = "".join(c.text for c in tok.children)  # type: ignore[attr-defined]
+        available = self.line // self.char_units(style)
+        lines = text.split("\n")
+        rows = [[cell.strip() for cell in line.split("|")] for line in lines]
+        ncols = max(len(r) for r in rows)
+        widths = [0] * ncols
+        for row in rows:
+            if len(row) > 1:
+                for i, cell in enumerate(row):
+                    widths[i] = max(widths[i], text_width(cell))
+
+        if sum(widths) + ncols - 1 > available:
+            # Does not fit the paper; lay it out as ordinary text instead
+            self.flow(tok.children, style)
+            return
+        # The last column is right-aligned against the edge of the paper
+        widths[-1] = available - sum(widths[:-1]) - (ncols - 1)
+
+        out = [""] if self.col else []  # a table starts on a line of its own
+        for line, row in zip(lines, rows):
+            if len(row) < 2:
+                # Not a row (a title or note); wrapped like ordinary text
+                self.col = 0
+                out.append(self.wrap(line, style))
+                continue
+            cells = [
+                _pad(cell, widths[i], right=(i == ncols - 1))
+                for i, cell in enumerate(row)
+            ]
+            out.append(" ".join(cells).rstrip())
+
+        for child in tok.children[1:]:
+            child.text = ""  # type: ignore[attr-defined]
+        tok.children[0].text = "\n".join(out)  # type: ignore[attr-defined]
+        last = out[-1].rsplit("\n", 1)[-1] if out else ""
+        self.col = text_width(last) * self.char_units(style) if last else 0
+
+    def _advance(self, col: int, text: str, cw: int) -> int:
+        for ch in text:
+            w = text_width(ch) * cw
+            if col + w > self.line:
+                col = 0
+            col += w
+        return col
+
+
+@lru_cache(maxsize=64)
+def _char_units(line: int, columns: int, width: int) -> int:
+    return line // columns * width
+
+
+def _pad(cell: str, width: int, right: bool) -> str:
+    fill = " " * (width - text_width(cell))
+    return fill + cell if right else cell + fill
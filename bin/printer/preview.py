@@ -0,0 +1,313 @@
+import argparse
+import base64
+import io
+import math
+from dataclasses import dataclass, field
+from datetime import datetime
+from functools import lru_cache
+from typing import Any, Dict, List, Optional, Tuple, Union
+from config.style import DEFAULT_STYLE, STYLE_KEYS
+from bin.message import Message
+from .layout import text_width
+from .printer import Printer
+
+# Dots per character cell at width/height 1 (Epson fonts A and B)
+FONT_CELLS: Dict[str, Tuple[int, int]] = {"a": (12, 24), "b": (9, 17)}
+QR_MODULE_DOTS = 3
+
+Style = Tuple[Any, ...]
+
+
+@dataclass
+class Line:
+    align: str
+    chars: List[Tuple[str, Style]] = field(default_factory=list)
+
+
+Block = Union[Line, Tuple[str, Any]]
+
+
+class PreviewDevice:
+    """Stands in for the python-escpos printer and records what would be printed."""
+
+    profile = None
+
+    def __init__(self) -> None:
+        self.stream: List[Tuple[str, Any]] = []
+        self.style: Dict[str, Any] = dict(DEFAULT_STYLE)
+
+    def set(self, **kw: Any) -> None:
+        self.style.update({k: v for k, v in kw.items() if k in STYLE_KEYS})
+
+    def text(self, text: str) -> None:
+        self.stream.append(("text", (text, tuple(self.style[k] for k in STYLE_KEYS))))
+
+    def image(self, image: Any, **kw: Any) -> None:
+        self.stream.append(("image", image))
+
+    def qr(self, content: str, **kw: Any) -> None:
+        self.stream.append(("qr", content))
+
+    def cut(self, *args: Any, **kw: Any) -> None:
+        self.stream.append(("cut", None))
+
+    def charcode(self, code: str) -> None:
+        pass
+
+    def close(self) -> None:
+        pass
+
+
+class PreviewPrinter(Printer):
+    """
+    A Printer whose output goes to a PreviewDevice, so the real
+    build_actions/PrinterAction pipeline can be rendered without paper.
+    """
+
+    def __init__(self, config: dict[str, Any]) -> None:
+        super().__init__(config, connect=False)
+        self.printer = PreviewDevice()
+        self.ready.set()
+
+    def print_text(self, text: str):
+        self.printer.text(text)
+
+    def print_image(self, image_path: str):
+        self.printer.image(image_path)
+
+    def render_message(self, message: Message, template: str = "{text}") -> List[Block]:
+        self.printer = PreviewDevice()
+        for action in self.build_actions(message, template):
+            action.run()
+        if self.config.get("always_cut") or message.cut:
+            self.printer.cut()
+        return self.lines()
+
+    def lines(self) -> List[Block]:
+        """Break the recorded stream into printed lines, wrapping like the printer."""
+        columns = self.font_columns()
+        unit_line = math.lcm(*columns.values())
+        blocks: List[Block] = []
+        line: Optional[Line] = None
+        used = 0
+
+        def finish() -> None:
+            nonlocal line, used
+            blocks.append(line or Line(self.printer.style["align"]))
+            line, used = None, 0
+
+        for kind, value in self.printer.stream:
+            if kind != "text":
+                if line is not None:
+                    finish()
+                blocks.append((kind, value))
+                continue
+            text, style = value
+            st = dict(zip(STYLE_KEYS, style))
+            cell = unit_line // (columns.get(st["font"]) or columns["a"]) * (st["width"] or 1)
+            for ch in text:
+                if ch == "\n":
+                    finish()
+                    continue
+                w = text_width(ch) * cell
+                if line is not None and used + w > unit_line:
+                    finish()
+                if line is None:
+                    line = Line(st["align"])
+                line.chars.append((ch, style))
+                used += w
+        if line is not None:
+            blocks.append(line)
+        return blocks
+
+
+def render_text(blocks: List[Block], columns: int = 42) -> str:
+    """Monospaced preview; sizes are shown by spacing glyphs out."""
+    out: List[str] = []
+    for block in blocks:
+        if isinstance(block, Line):
+            cells = "".join(
+                ch + " " * ((dict(zip(STYLE_KEYS, st))["width"] or 1) - 1)
+                for ch, st in block.chars
+            ).rstrip()
+            if block.align == "center":
+                cells = cells.center(columns).rstrip()
+            elif block.align == "right":
+                cells = cells.rjust(columns)
+            out.append(cells)
+        else:
+            kind, value = block
+            if kind == "image":
+                label = f"{value.width}x{value.height}" if hasattr(value, "size") else value
+                out.append(f"[image: {label}]".center(columns).rstrip())
+            elif kind == "qr":
+                out.append(f"[QR: {value}]".center(columns).rstrip())
+            elif kind == "cut":
+                out.append(f"{' cut ':-^{columns}}")
+    return "\n".join(out) + "\n"
+
+
+@lru_cache(maxsize=4096)
+def glyph(ch: str, style: Style) -> Any:
+    """Render one character cell in the given style (cached)."""
+    from PIL import Image, ImageChops, ImageDraw
+
+    st = dict(zip(STYLE_KEYS, style))
+    cell_w, cell_h = FONT_CELLS.get(st["font"], FONT_CELLS["a"])
+    cell_w *= text_width(ch) or 1
+
+    img = Image.new("L", (cell_w, cell_h), 255)
+    draw = ImageDraw.Draw(img)
+    font = _font(cell_h)
+    left, top, right, bottom = draw.textbbox((0, 0), ch, font=font)
+    x = (cell_w - (right - left)) // 2 - left
+    y = (cell_h - (bottom - top)) // 2 - top
+    draw.text((x, y), ch, font=font, fill=0)
+    if st["bold"]:
+        draw.text((x + 1, y), ch, font=font, fill=0)
+    if st["underline"]:
+        draw.rectangle((0, cell_h - st["underline"], cell_w, cell_h - 1), fill=0)
+
+    img = img.resize((cell_w * (st["width"] or 1), cell_h * (st["height"] or 1)))
+    if st["invert"]:
+        img = ImageChops.invert(img)
+    if st["flip"]:
+        img = img.rotate(180)
+    return img
+
+
+@lru_cache(maxsize=8)
+def _font(cell_h: int) -> Any:
+    from PIL import ImageFont
+
+    try:
+        return ImageFont.load_default(size=cell_h - 4)
+    except TypeError:
+        # Pillow < 10.1 only has the fixed-size bitmap font
+        return ImageFont.load_default()
+
+
+def render_png(blocks: List[Block], paper_dots: int) -> bytes:
+    from PIL import Image, ImageDraw
+
+    rows: List[Any] = []
+    for block in blocks:
+        if isinstance(block, Line):
+            glyphs = [glyph(ch, st) for ch, st in block.chars]
+            if block.chars and all(dict(zip(STYLE_KEYS, st))["flip"] for _, st in block.chars):
+                # Upside-down mode turns the whole line around
+                glyphs.reverse()
+            height = max((g.height for g in glyphs), default=FONT_CELLS["a"][1])
+            width = sum(g.width for g in glyphs)
+            row = Image.new("L", (paper_dots, height), 255)
+            x = {"center": (paper_dots - width) // 2, "right": paper_dots - width}.get(
+                block.align, 0
+            )
+            for g in glyphs:
+                row.paste(g, (max(x, 0), height - g.height))
+                x += g.width
+            rows.append(row)
+            continue
+
+        kind, value = block
+        if kind == "image":
+            img = value if hasattr(value, "convert") else Image.open(value)
+            img = img.convert("L")
+            if img.width > paper_dots:
+                img = img.resize((paper_dots, img.height * paper_dots // img.width))
+            rows.append(img)
+        elif kind == "qr":
+            rows.append(_qr_image(value, paper_dots))
+        elif kind == "cut":
+            row = Image.new("L", (paper_dots, 24), 255)
+            draw = ImageDraw.Draw(row)
+            for x in range(0, paper_dots, 16):
+                draw.line((x, 12, x + 8, 12), fill=0, width=2)
+            rows.append(row)
+
+    canvas = Image.new("L", (paper_dots, sum(r.height for r in rows) or 1), 255)
+    y = 0
+    for row in rows:
+        canvas.paste(row, (0, y))
+        y += row.height
+    buffer = io.BytesIO()
+    # Threshold rather than dither, so anti-aliased glyph edges stay crisp
+    canvas.point(lambda v: 255 if v >= 128 else 0, "1").save(buffer, "PNG")
+    return buffer.getvalue()
+
+
+def _qr_image(content: str, paper_dots: int) -> Any:
+    from PIL import Image, ImageDraw
+
+    try:
+        import qrcode  # type: ignore
+
+        qr = qrcode.QRCode(border=1, box_size=QR_MODULE_DOTS)
+        qr.add_data(content)
+        img = qr.make_image().get_image().convert("L")
+    except ImportError:
+        img = Image.new("L", (29 * QR_MODULE_DOTS,) * 2, 255)
+        draw = ImageDraw.Draw(img)
+        draw.rectangle((0, 0, img.width - 1, img.height - 1), outline=0, width=2)
+        draw.text((6, img.height // 2 - 6), "QR", fill=0)
+    row = Image.new("L", (paper_dots, img.height), 255)
+    row.paste(img, (0, 0))
+    return row
+
+
+def render_preview(
+    printer: PreviewPrinter, message: Message, template: str, fmt: str = "text"
+) -> Union[str, bytes]:
+    blocks = printer.render_message(message, template)
+    columns = printer.font_columns()
+    if fmt == "png":
+        return render_png(blocks, columns["a"] * FONT_CELLS["a"][0])
+    return render_text(blocks, columns["a"])
+
+
+def main() -> None:
+    from bin.load import CONFIG, load_template_by_name
+    from bin.server import process_text
+
+    parser = argparse.ArgumentParser(description="Render a print preview without a printer")
+    parser.add_argument("--text", default="", help="message text")
+    parser.add_argument("--sender", default="preview")
+    parser.add_argument("--image", help="path to an image to include")
+    parser.add_argument("--template", help="template name from config/template/")
+    parser.add_argument("--custom-template", help="inline template string")
+    parser.add_argument("--format", choices=("text", "png"), default="text")
+    parser.add_argument("-o", "--output", help="output file (default: stdout)")
+    args = parser.parse_args()
+
+    config = CONFIG["printer"]
+    template = load_template_by_name(
+        args.template or config.get("template_name", "debug")
+    ) or "{text}"
+    image_path = None
+    if args.image:
+        from bin.images import process_image
+
+        with open(args.image, "rb") as f:
+            image_path = process_image(f.read(), config["image"])
+
+    message = Message(
+        id="preview",
+        text=process_text(args.text),
+        sender=args.sender,
+        dt_received=datetime.now(),
+        image_path=image_path,  # type: ignore[arg-type]
+        custom_template=args.custom_template,
+    )
+    result = render_preview(PreviewPrinter(config), message, template, args.format)
+    if args.output:
+        mode = "wb" if isinstance(result, bytes) else "w"
+        with open(args.output, mode) as f:
+            f.write(result)
+    elif isinstance(result, bytes):
+        print(base64.b64encode(result).decode())
+    else:
+        print(result, end="")
+
+
+if __name__ == "__main__":
+    main()
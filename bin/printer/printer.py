@@ -1,18 +1,30 @@
-from escpos.printer import Serial, Usb  # type: ignore
 from bin.load import CONFIG
 from bin.message import Message
 from .action import PrinterAction
-from bin.utils import encode_cp858
+from .encoding import CodePageEncoder
 from config.style import DEFAULT_STYLE
 from datetime import datetime
-from typing import List, Any
+from typing import List, Any, Optional, Tuple
 import re
 from .tokens.tokens import Token, TextToken, StyledToken
 from .tokens.parser import parse_tokens
-from time import sleep
+from .layout import LineLayout
+from .raster import BandPacer, load_bitmap, stream_image
+from time import perf_counter, sleep
 from bin.logger import logging
+from bin.profiler import TRACER
 import sys
 import io
+import threading
+
+
+class PrintInterrupted(RuntimeError):
+    """A print job failed part way; `completed` actions went out before the error."""
+
+    def __init__(self, completed: int, cause: Exception) -> None:
+        super().__init__(f"Print job interrupted after {completed} actions: {cause}")
+        self.completed = completed
+        self.cause = cause
 
 
 def _format_dt(dt):
@@ -24,13 +36,87 @@ def _format_dt(dt):
 
 
 class Printer:
-    def __init__(self, config: dict[str, Any]) -> None:
+    def __init__(self, config: dict[str, Any], connect: bool = True) -> None:
         self.name = config.get("name", "printer")
         self.connection_type = config.get("connection_type", "serial").lower()
         self.config = config
-        self.connect()
-        self.printer.charcode(config.get("charcode", "CP858"))
+        # Set once connected and initialized; print jobs wait for it
+        self.ready = threading.Event()
+        # Kept across images, so back-to-back images are paced together
+        self.pacer: Optional[BandPacer] = None
+        if connect:
+            self.connect()
+            self.initialize()
+
+    def initialize(self) -> None:
+        self.encoder = self.build_encoder(self.config.get("charcode", "CP858"))
+        self.pacer = None
         self.default_settings().run()
+        self.ready.set()
+
+    def build_encoder(self, charcode: str) -> CodePageEncoder:
+        try:
+            profile_pages = self.printer.profile.get_code_pages()
+        except Exception as e:
+            logging.getLogger(__name__).warning(
+                f"No code pages in printer profile ({e}); using {charcode} only"
+            )
+            self.printer.charcode(charcode)
+            return CodePageEncoder([(charcode, 0)], charcode)
+        encoder = CodePageEncoder.for_profile(
+            profile_pages, charcode, self.config.get("code_pages")
+        )
+        if encoder.pages:
+            self.printer.charcode(encoder.pages[encoder.current][0])
+            # Put the printer on the page the encoder starts from
+            self.printer._raw(encoder.select())
+        logging.getLogger(__name__).info(
+            f"Code pages: {', '.join(name for name, _, _ in encoder.pages)}"
+        )
+        return encoder
+
+    def connect_with_retry(self, initial_delay: float = 1, max_delay: float = 60) -> None:
+        """Connect and initialize, retrying with exponential backoff until it works."""
+        delay = initial_delay
+        while True:
+            try:
+                self.connect()
+                self.initialize()
+                return
+            except Exception as e:
+                logging.getLogger(__name__).warning(
+                    f"{e}; retrying in {delay:.0f} s"
+                )
+                sleep(delay)
+                delay = min(delay * 2, max_delay)
+
+    def disconnect(self) -> None:
+        self.ready.clear()
+        printer = getattr(self, "printer", None)
+        if printer is not None:
+            try:
+                printer.close()
+            except Exception as e:
+                logging.getLogger(__name__).debug(f"Closing {self.name} failed: {e}")
+
+    def reconnect(self, initial_delay: float = 1, max_delay: float = 60) -> None:
+        self.disconnect()
+        self.connect_with_retry(initial_delay, max_delay)
+
+    def is_healthy(self) -> bool:
+        """
+        Ask the printer for its real-time status (DLE EOT) when
+        `health_check.status_query` is enabled; otherwise trust the link.
+        """
+        if not self.ready.is_set():
+            return False
+        if not self.config.get("health_check", {}).get("status_query", False):
+            return True
+        try:
+            return bool(self.printer.is_online())
+        except Exception as e:
+            logging.getLogger(__name__).warning(f"Status query failed: {e}")
+            return False
 
     def connect(self) -> None:
         log = logging.getLogger(__name__)
@@ -39,6 +125,9 @@ class Printer:
         old_stdout = sys.stdout
         sys.stdout = buffer = io.StringIO()
         try:
+            # python-escpos loads its printer profile database on import
+            from escpos.printer import Serial, Usb  # type: ignore
+
             if self.connection_type == "serial":
                 self.printer = Serial(
                     devfile=self.config.get("port", "/dev/ttyUSB0"),
@@ -58,6 +147,7 @@ class Printer:
                     timeout=self.config.get("timeout", 0),
                     in_ep=self.config.get("in_ep", 0x82),
                     out_ep=self.config.get("out_ep", 0x01),
+                    profile=self.config.get("profile", "TM-T88III"),
                 )
             else:
                 raise ValueError(f"Unknown connection type: {self.connection_type}")
@@ -73,10 +163,37 @@ class Printer:
         log.info(f"Connected to {self.name}")
 
     def print_text(self, text: str):
-        self.printer._raw(encode_cp858(text))  # type: ignore
+        self.printer._raw(self.encoder.encode(text))  # type: ignore
 
     def print_image(self, image_path: str):
-        self.printer.image(image_path)  # type: ignore
+        """Stream the image in bands (see bin.printer.raster), paced to the printer."""
+        config = self.config.get("image_stream", {})
+        image = load_bitmap(image_path)
+        max_width = self.media_width()
+        if max_width and image.width > max_width:
+            raise ValueError(f"Image is {image.width} dots wide, the printer only {max_width}")
+        if self.pacer is None:
+            status = self.config.get("health_check", {}).get("status_query", False)
+            self.pacer = BandPacer(
+                config.get("rows_per_s", 0),
+                config.get("buffer_rows", 256),
+                self.printer.is_online if status else None,
+            )
+        stream_image(
+            self.printer._raw,  # type: ignore
+            image,
+            self.pacer,
+            band_rows=config.get("band_rows", 128),
+            ahead=config.get("bands_ahead", 2),
+            impl=config.get("impl", "raster"),
+        )
+
+    def media_width(self) -> Optional[int]:
+        """Printable width in dots from the printer profile, if it knows it."""
+        try:
+            return int(self.printer.profile.profile_data["media"]["width"]["pixels"])
+        except (AttributeError, KeyError, TypeError, ValueError):
+            return None
 
     def print_qr(self, url: str):
         self.printer.qr(url)  # type: ignore
@@ -84,15 +201,60 @@ class Printer:
     def cut(self):
         self.printer.cut()
 
+    def font_columns(self) -> dict[str, int]:
+        """
+        Characters per line for fonts a and b: from the printer profile, with
+        any font set in the `columns` config taking precedence.
+        """
+        try:
+            fonts = self.printer.profile.profile_data["fonts"]
+            columns = {"a": int(fonts["0"]["columns"]), "b": int(fonts["1"]["columns"])}
+        except Exception:
+            columns = {"a": 42, "b": 56}
+        columns.update(self.config.get("columns") or {})
+        return columns
+
     def default_settings(self) -> PrinterAction:
         return PrinterAction("defaults", self.printer.set, **DEFAULT_STYLE)
 
-    def print_message(self, message: Message, template="{text}") -> None:
-        actions = self.build_actions(message, template)
-        for action in actions:
-            action.run()
-        if self.config.get("always_cut") or getattr(message, "cut", False):
-            self.printer.cut()
+    def print_message(
+        self, message: Message, template="{text}", resume_from: int = 0
+    ) -> None:
+        """
+        Print a message. With `resume_from`, skip the actions that were already
+        sent before an interruption, restoring the style that was active there.
+        Raises PrintInterrupted if an action fails.
+        """
+        # With tracing on, time every action of the job
+        timings: Optional[List[Tuple[str, float]]] = [] if TRACER.enabled else None
+        started, t = datetime.now(), perf_counter()
+        done = resume_from
+        try:
+            actions = self.build_actions(message, template)
+            if timings is not None:
+                timings.append(("build actions", perf_counter() - t))
+            if resume_from:
+                for action in reversed(actions[:resume_from]):
+                    if action.func == self.printer.set:
+                        action.run()
+                        break
+
+            for action in actions[resume_from:]:
+                if timings is None:
+                    action.run()
+                else:
+                    t = perf_counter()
+                    action.run()
+                    timings.append((action.desc, perf_counter() - t))
+                done += 1
+            if self.config.get("always_cut") or getattr(message, "cut", False):
+                self.printer.cut()
+        except Exception as e:
+            if timings is not None:
+                TRACER.record(message.id, started, timings, error=str(e))
+            raise PrintInterrupted(done, e) from e
+        if timings is not None:
+            TRACER.record(message.id, started, timings)
 
     def build_actions(self, m: Message, tmpl: str) -> List[PrinterAction]:
         # Use .get and getattr to avoid errors if keys/attributes are missing
@@ -128,6 +290,7 @@ class Printer:
 
         actions: List[PrinterAction] = []
         strip_leading_nl = False
+        layout = LineLayout(self.font_columns())
 
         def append_token_actions(tok: Token) -> None:
             nonlocal strip_leading_nl
@@ -153,7 +316,7 @@ class Printer:
                 continue
 
             if part == "{text}":
-                for t in parse_tokens(m.text):
+                for t in layout.flow(parse_tokens(m.text)):
                     append_token_actions(t)
 
             elif part == "{image}":
@@ -161,13 +324,7 @@ class Printer:
                     actions.append(
                         PrinterAction("image", self.print_image, m.image_path)
                     )
-                    actions.append(
-                        PrinterAction(
-                            "cool-down",
-                            sleep,
-                            self.config.get("cooldown_ms", {}).get("image", 0) / 1000,
-                        )
-                    )
+                    layout.newline()
 
             elif part == "{qr_codes}":
                 if show_qr and urls:
@@ -177,7 +334,8 @@ class Printer:
                             index = len(seen) + 1
                             seen[url] = index
                             actions.append(PrinterAction("qr", self.print_qr, url))
-                            label = f"[{index}] {url}" if ref_urls else url
+                            layout.newline()
+                            label = layout.wrap(f"[{index}] {url}" if ref_urls else url)
                             actions.append(
                                 PrinterAction("qr label", self.print_text, label)
                             )
@@ -186,7 +344,7 @@ class Printer:
                 continue
 
             else:
-                for t in parse_tokens(part):
+                for t in layout.flow(parse_tokens(part)):
                     append_token_actions(t)
 
         return actions
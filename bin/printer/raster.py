@@ -0,0 +1,179 @@
+import queue
+import threading
+import time
+from typing import TYPE_CHECKING, Any, Callable, Iterator, Optional, Tuple, Union
+
+if TYPE_CHECKING:
+    from PIL import Image
+
+GS = b"\x1d"
+# PIL's 1-bit images use 1 for white, ESC/POS uses 1 for a dot
+_INVERT = bytes(255 - b for b in range(256))
+_END = object()
+
+
+def load_bitmap(source: Union[str, "Image.Image"]) -> "Image.Image":
+    """
+    Open an image as 1-bit. Stored images are already dithered to 1-bit
+    (see bin.images.process_image); anything else is flattened onto white
+    and converted the way python-escpos does.
+    """
+    from PIL import Image
+
+    image = source if isinstance(source, Image.Image) else Image.open(source)
+    if image.mode == "1":
+        return image
+    rgba = image.convert("RGBA")
+    flat = Image.new("RGB", rgba.size, (255, 255, 255))
+    flat.paste(rgba, mask=rgba.split()[3])
+    return flat.convert("L").convert("1")
+
+
+def _low_high(n: int, length: int) -> bytes:
+    return n.to_bytes(length, "little")
+
+
+def band_command(data: bytes, width: int, rows: int, impl: str = "raster") -> bytes:
+    """
+    Print command for one band of raster data (`rows` rows of ceil(width/8)
+    bytes): GS v 0, or GS ( L store + print for impl="graphics".
+    """
+    if impl == "raster":
+        return GS + b"v0\x00" + _low_high((width + 7) // 8, 2) + _low_high(rows, 2) + data
+    if impl == "graphics":
+        store = b"0p0\x01\x011" + _low_high(width, 2) + _low_high(rows, 2) + data
+        if len(store) > 0xFFFF:
+            raise ValueError("Image band too large for GS ( L; lower band_rows")
+        return (
+            GS + b"(L" + _low_high(len(store), 2) + store
+            + GS + b"(L" + _low_high(2, 2) + b"02"
+        )
+    raise ValueError(f"Unknown image implementation: {impl}")
+
+
+def image_bands(
+    image: "Image.Image", band_rows: int = 128, impl: str = "raster"
+) -> Iterator[Tuple[int, bytes]]:
+    """
+    Yield (rows, command) for horizontal bands of a 1-bit image, converting
+    each band only when it is asked for.
+    """
+    from PIL import Image
+
+    width, height = image.size
+    padded = (width + 7) // 8 * 8
+    for top in range(0, height, band_rows):
+        rows = min(band_rows, height - top)
+        band = image.crop((0, top, width, top + rows))
+        if padded != width:
+            # Pad rows to whole bytes with white, which inverts to no dot
+            canvas = Image.new("1", (padded, rows), 1)
+            canvas.paste(band)
+            band = canvas
+        yield rows, band_command(band.tobytes().translate(_INVERT), width, rows, impl)
+
+
+class BandPacer:
+    """
+    Paces image bands so the printer's receive buffer does not overflow,
+    instead of a fixed pause after each image.
+
+    ESC/POS has no portable way to ask how full the buffer is, so the
+    buffer is modelled: every band adds its rows, and the printer drains
+    `rows_per_s` of them. A band is only held back as long as it would not
+    fit into `buffer_rows`, so a slow link (whose writes already take longer
+    than printing) never waits. With `status`, a real-time status query that
+    printers answer even with a full buffer, the pacer also waits while the
+    printer reports itself offline (paper out, cover open) rather than
+    piling more data into it, for at most `offline_timeout_s`.
+    """
+
+    def __init__(
+        self,
+        rows_per_s: float = 0,
+        buffer_rows: int = 256,
+        status: Optional[Callable[[], bool]] = None,
+        offline_timeout_s: float = 30,
+    ) -> None:
+        self.rows_per_s = rows_per_s
+        self.buffer_rows = buffer_rows
+        self.status = status
+        self.offline_timeout_s = offline_timeout_s
+        self.buffered = 0.0
+        self._last = time.monotonic()
+
+    def wait(self, rows: int) -> None:
+        """Block until `rows` more rows can be sent, then account for them."""
+        if self.rows_per_s > 0:
+            self._drain()
+            excess = self.buffered + rows - max(self.buffer_rows, rows)
+            if excess > 0:
+                if self.status:
+                    self._wait_online()
+                    self._drain()
+                    excess = self.buffered + rows - max(self.buffer_rows, rows)
+                if excess > 0:
+                    time.sleep(excess / self.rows_per_s)
+                    self._drain()
+            self.buffered += rows
+
+    def _drain(self) -> None:
+        now = time.monotonic()
+        self.buffered = max(0.0, self.buffered - (now - self._last) * self.rows_per_s)
+        self._last = now
+
+    def _wait_online(self) -> None:
+        deadline = time.monotonic() + self.offline_timeout_s
+        while not self.status():  # type: ignore[misc]
+            if time.monotonic() >= deadline:
+                raise TimeoutError(f"Printer offline for {self.offline_timeout_s:.0f} s")
+            time.sleep(0.1)
+
+
+def stream_image(
+    write: Callable[[bytes], Any],
+    image: "Image.Image",
+    pacer: BandPacer,
+    band_rows: int = 128,
+    ahead: int = 2,
+    impl: str = "raster",
+) -> None:
+    """
+    Send an image band by band. A helper thread converts up to `ahead`
+    bands in advance, so converting the next band overlaps sending this one
+    and memory stays bounded to a few bands.
+    """
+    bands: "queue.Queue[Any]" = queue.Queue(maxsize=max(1, ahead))
+    stop = threading.Event()
+
+    def put(item: Any) -> bool:
+        while not stop.is_set():
+            try:
+                bands.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def produce() -> None:
+        try:
+            for band in image_bands(image, band_rows, impl):
+                if not put(band):
+                    return
+        except Exception as e:
+            put(e)
+            return
+        put(_END)
+
+    producer = threading.Thread(target=produce, name="image-bands", daemon=True)
+    producer.start()
+    try:
+        while (item := bands.get()) is not _END:
+            if isinstance(item, Exception):
+                raise item
+            rows, command = item
+            pacer.wait(rows)
+            write(command)
+    finally:
+        stop.set()
+        producer.join()
@@ -124,3 +124,9 @@ class FlipToken(StyledToken):
 
 class CodeToken(StyledToken):
     tag, font = "<code>", "b"
+
+
+class TableToken(StyledToken):
+    """Lines of `|`-separated cells, laid out in columns by the layout stage."""
+
+    tag = "<table>"
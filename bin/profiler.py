@@ -0,0 +1,247 @@
+import json
+import os
+import re
+import sys
+import threading
+import time
+from collections import Counter, deque
+from datetime import datetime
+from types import CodeType, FrameType
+from typing import Any, Callable, Deque, Dict, Iterable, List, Optional, Tuple
+from urllib.parse import parse_qs
+from bin.logger import logging
+
+_THREAD_NAME = re.compile(r"Thread-\d+ \((.+)\)")
+
+
+def _thread_label(name: str) -> str:
+    # Short-lived client threads are merged under their target's name
+    match = _THREAD_NAME.fullmatch(name)
+    return match[1] if match else name
+
+
+class SamplingProfiler:
+    """
+    Statistical profiler for all threads of the running service.
+
+    A background thread snapshots every thread's stack with
+    sys._current_frames() each `interval_s` and counts identical stacks, so
+    the overhead does not depend on how much code runs. The result is in the
+    collapsed-stack format read by flamegraph.pl and speedscope, one root
+    frame per thread. Sampling stops by itself after `max_duration_s`.
+    """
+
+    def __init__(self) -> None:
+        self.interval_s = 0.005
+        self.max_duration_s = 300.0
+        self.started: Optional[float] = None
+        self.duration_s = 0.0
+        self.samples = 0
+        self._stacks: Counter = Counter()
+        self._labels: Dict[CodeType, str] = {}
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+
+    @property
+    def running(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self, interval_s: Optional[float] = None, max_duration_s: Optional[float] = None) -> bool:
+        """Start sampling from scratch; returns False if already running."""
+        with self._lock:
+            if self.running:
+                return False
+            self.interval_s = interval_s or self.interval_s
+            self.max_duration_s = max_duration_s or self.max_duration_s
+            self._stacks = Counter()
+            self.samples = 0
+            self.started = time.monotonic()
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name="profiler", daemon=True)
+            self._thread.start()
+        logging.getLogger(__name__).info(
+            f"Sampling profiler started ({self.interval_s * 1000:.0f} ms interval)"
+        )
+        return True
+
+    def stop(self) -> None:
+        self._stop.set()
+        thread = self._thread
+        if thread is not None:
+            thread.join()
+
+    def collapsed(self, thread: Optional[str] = None) -> str:
+        """Collapsed stacks ("thread;outer;...;inner count" per line), optionally for one thread."""
+        with self._lock:
+            stacks = list(self._stacks.items())
+        lines = [
+            f"{';'.join(stack)} {count}"
+            for stack, count in stacks
+            if thread is None or stack[0] == thread
+        ]
+        return "\n".join(sorted(lines)) + ("\n" if lines else "")
+
+    def _run(self) -> None:
+        own = threading.get_ident()
+        deadline = time.monotonic() + self.max_duration_s
+        while not self._stop.wait(self.interval_s):
+            names = {t.ident: _thread_label(t.name) for t in threading.enumerate()}
+            frames = sys._current_frames()
+            with self._lock:
+                for ident, frame in frames.items():
+                    if ident != own:
+                        self._stacks[(names.get(ident, str(ident)), *self._stack(frame))] += 1
+                self.samples += 1
+            if time.monotonic() >= deadline:
+                break
+        self.duration_s = time.monotonic() - (self.started or 0)
+        logging.getLogger(__name__).info(
+            f"Sampling profiler stopped after {self.samples} samples"
+        )
+
+    def _stack(self, frame: Optional[FrameType]) -> Tuple[str, ...]:
+        stack: List[str] = []
+        while frame is not None:
+            stack.append(self._label(frame.f_code))
+            frame = frame.f_back
+        stack.reverse()
+        return tuple(stack)
+
+    def _label(self, code: CodeType) -> str:
+        label = self._labels.get(code)
+        if label is None:
+            name = getattr(code, "co_qualname", code.co_name)
+            label = self._labels[code] = f"{os.path.basename(code.co_filename)}:{name}"
+        return label
+
+
+class ActionTracer:
+    """
+    Records how long each PrinterAction of the last `max_jobs` print jobs
+    took. Off by default; Printer.print_message only times actions while it
+    is enabled.
+    """
+
+    def __init__(self, max_jobs: int = 50) -> None:
+        self.enabled = False
+        self.jobs: Deque[Dict[str, Any]] = deque(maxlen=max_jobs)
+
+    def start(self, max_jobs: Optional[int] = None) -> None:
+        if max_jobs and max_jobs != self.jobs.maxlen:
+            self.jobs = deque(self.jobs, maxlen=max_jobs)
+        self.enabled = True
+
+    def stop(self) -> None:
+        self.enabled = False
+
+    def record(
+        self,
+        message_id: str,
+        started: datetime,
+        actions: List[Tuple[str, float]],
+        error: Optional[str] = None,
+    ) -> None:
+        self.jobs.append(
+            {
+                "id": message_id,
+                "started": started.isoformat(),
+                "total_ms": round(sum(t for _, t in actions) * 1000, 3),
+                "actions": [(desc, round(t * 1000, 3)) for desc, t in actions],
+                "error": error,
+            }
+        )
+
+    def report(self) -> List[Dict[str, Any]]:
+        return list(self.jobs)
+
+
+PROFILER = SamplingProfiler()
+TRACER = ActionTracer()
+
+
+def control(value: Dict[str, Any], config: Dict[str, Any]) -> str:
+    """
+    Handle the "profiler" / "trace" keys of a control request ("start",
+    "stop" or "dump"). Returns the reply line; stop and dump reply with the
+    results as one line of JSON.
+    """
+    if not config.get("enabled", False):
+        raise ValueError("Profiling is disabled (server.profiling.enabled).")
+    reply: Dict[str, Any] = {}
+
+    if (action := value.get("profiler")) is not None:
+        if action == "start":
+            started = PROFILER.start(
+                config.get("interval_ms", 5) / 1000, config.get("max_duration_s", 300)
+            )
+            return "Profiler started." if started else "Profiler already running."
+        if action not in ("stop", "dump"):
+            raise ValueError("'profiler' must be 'start', 'stop' or 'dump'.")
+        if action == "stop":
+            PROFILER.stop()
+        reply.update(profile=PROFILER.collapsed(), samples=PROFILER.samples)
+
+    if (action := value.get("trace")) is not None:
+        if action == "start":
+            TRACER.start(config.get("trace_jobs", 50))
+            return "Tracing started."
+        if action not in ("stop", "dump"):
+            raise ValueError("'trace' must be 'start', 'stop' or 'dump'.")
+        if action == "stop":
+            TRACER.stop()
+        reply.update(trace=TRACER.report())
+
+    return json.dumps(reply, separators=(",", ":"))
+
+
+def debug_app(config: Dict[str, Any]) -> Callable[..., Iterable[bytes]]:
+    """
+    WSGI app for the /debug/ endpoints on the metrics port:
+
+        POST /debug/profile/start?interval_ms=5&max_s=300   POST /debug/profile/stop
+        GET  /debug/profile[?thread=worker]                 (collapsed stacks)
+        POST /debug/trace/start?jobs=50                     POST /debug/trace/stop
+        GET  /debug/trace                                   (JSON)
+    """
+
+    def app(environ: Dict[str, Any], start_response: Callable[..., Any]) -> Iterable[bytes]:
+        path = environ.get("PATH_INFO", "")
+        method = environ.get("REQUEST_METHOD", "GET")
+        query = {k: v[0] for k, v in parse_qs(environ.get("QUERY_STRING", "")).items()}
+
+        def respond(status: str, body: str, content_type: str = "text/plain") -> List[bytes]:
+            data = body.encode()
+            start_response(
+                status,
+                [("Content-Type", f"{content_type}; charset=utf-8"), ("Content-Length", str(len(data)))],
+            )
+            return [data]
+
+        try:
+            if path in ("/debug/profile/start", "/debug/profile/stop", "/debug/trace/start", "/debug/trace/stop"):
+                if method != "POST":
+                    return respond("405 Method Not Allowed", "Use POST.\n")
+                if path == "/debug/profile/start":
+                    started = PROFILER.start(
+                        float(query.get("interval_ms", config.get("interval_ms", 5))) / 1000,
+                        float(query.get("max_s", config.get("max_duration_s", 300))),
+                    )
+                    return respond("200 OK", "started\n" if started else "already running\n")
+                if path == "/debug/profile/stop":
+                    PROFILER.stop()
+                    return respond("200 OK", PROFILER.collapsed(query.get("thread")))
+                if path == "/debug/trace/start":
+                    TRACER.start(int(query.get("jobs", config.get("trace_jobs", 50))))
+                    return respond("200 OK", "started\n")
+                TRACER.stop()
+                return respond("200 OK", json.dumps(TRACER.report()), "application/json")
+            if path == "/debug/profile":
+                return respond("200 OK", PROFILER.collapsed(query.get("thread")))
+            if path == "/debug/trace":
+                return respond("200 OK", json.dumps(TRACER.report()), "application/json")
+        except ValueError as e:
+            return respond("400 Bad Request", f"{e}\n")
+        return respond("404 Not Found", "Not found.\n")
+
+    return app
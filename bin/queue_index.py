@@ -0,0 +1,141 @@
+import os
+import threading
+from bisect import insort
+from dataclasses import dataclass
+from typing import Dict, Iterable, List, NamedTuple, Optional, Tuple
+from bin.record import QueueRecord
+
+
+@dataclass(slots=True)
+class IndexEntry:
+    id: str
+    shard: int
+    doc_id: int
+    priority: int
+    printkey: str
+    received_us: int
+    has_image: bool
+    size: int
+    idempotency_key: str
+
+    @property
+    def arrival(self) -> Tuple[bool, int, str]:
+        """Oldest first; entries without a receive time go last, ordered by id."""
+        return (self.received_us == 0, self.received_us, self.id)
+
+    @classmethod
+    def from_record(cls, shard: int, doc_id: int, record: QueueRecord) -> "IndexEntry":
+        size = len(record.raw)
+        if image_path := record.image_path:
+            try:
+                size += os.path.getsize(image_path)
+            except OSError:
+                pass
+        return cls(
+            id=record.id,
+            shard=shard,
+            doc_id=doc_id,
+            priority=record.priority,
+            printkey=record.printkey or "",
+            received_us=record.received_us,
+            has_image=record.has_image,
+            size=size,
+            idempotency_key=record.idempotency_key or "",
+        )
+
+
+class QueueStats(NamedTuple):
+    queued: int
+    images: int
+    bytes: int
+
+
+# priority -> printkey -> entries in arrival order
+Lanes = Dict[int, Dict[str, List[Tuple[Tuple[bool, int, str], IndexEntry]]]]
+
+
+class QueueIndex:
+    """
+    In-memory index over the queued messages, grouped into priority lanes and,
+    within a lane, per-printkey queues in arrival order.
+
+    Dequeueing only looks at the highest non-empty lane and the head of each
+    printkey queue in it, so it never scans the whole queue.
+    """
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._entries: Dict[str, IndexEntry] = {}
+        self._lanes: Lanes = {}
+        self._images = 0
+        self._bytes = 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def __contains__(self, message_id: str) -> bool:
+        return message_id in self._entries
+
+    def get(self, message_id: str) -> Optional[IndexEntry]:
+        return self._entries.get(message_id)
+
+    def replace_shard(self, shard: int, records: Iterable[Tuple[int, QueueRecord]]) -> None:
+        """Replace the entries of one shard with `records` ((doc_id, record) pairs)."""
+        entries = [IndexEntry.from_record(shard, doc_id, record) for doc_id, record in records]
+        with self._lock:
+            for entry in [e for e in self._entries.values() if e.shard == shard]:
+                self._remove(entry.id)
+            for entry in entries:
+                self._add(entry)
+
+    def add(self, shard: int, doc_id: int, record: QueueRecord) -> None:
+        entry = IndexEntry.from_record(shard, doc_id, record)
+        with self._lock:
+            self._add(entry)
+
+    def remove(self, message_id: str) -> None:
+        with self._lock:
+            self._remove(message_id)
+
+    def _remove(self, message_id: str) -> None:
+        entry = self._entries.pop(message_id, None)
+        if entry is None:
+            return
+        self._images -= entry.has_image
+        self._bytes -= entry.size
+        lane = self._lanes[entry.priority]
+        queue = lane[entry.printkey]
+        queue.remove((entry.arrival, entry))
+        if not queue:
+            del lane[entry.printkey]
+        if not lane:
+            del self._lanes[entry.priority]
+
+    def stats(self) -> QueueStats:
+        with self._lock:
+            return QueueStats(len(self._entries), self._images, self._bytes)
+
+    def with_idempotency_keys(self) -> List[IndexEntry]:
+        """Entries that carry an idempotency key, oldest first."""
+        with self._lock:
+            entries = [e for e in self._entries.values() if e.idempotency_key]
+        return sorted(entries, key=lambda e: e.arrival)
+
+    def top_lane(self) -> Tuple[Optional[int], Dict[str, IndexEntry]]:
+        """Return the highest priority with queued messages and its per-key heads."""
+        with self._lock:
+            if not self._lanes:
+                return None, {}
+            priority = max(self._lanes)
+            return priority, {
+                key: queue[0][1] for key, queue in self._lanes[priority].items()
+            }
+
+    def _add(self, entry: IndexEntry) -> None:
+        if entry.id in self._entries:
+            return
+        self._entries[entry.id] = entry
+        self._images += entry.has_image
+        self._bytes += entry.size
+        lane = self._lanes.setdefault(entry.priority, {})
+        insort(lane.setdefault(entry.printkey, []), (entry.arrival, entry))
@@ -0,0 +1,156 @@
+"""
+Queue maintenance commands; safe to run while the service is running.
+
+    python -m bin.queuectl export backup.jsonl.gz
+    python -m bin.queuectl import backup.jsonl.gz
+    python -m bin.queuectl replay --since 2026-10-18T08:00 --until 2026-10-18T12:00 --to host:9000 --api-key KEY
+    python -m bin.queuectl replay --since 2026-10-18 --enqueue
+"""
+import argparse
+import uuid
+from collections import Counter
+from datetime import datetime, timedelta
+from pathlib import Path
+from typing import Iterator, List, Optional
+from bin.archive import export_queue, import_queue
+from bin.db import acquire_image, release_image, store_message
+from bin.history import JobHistory
+from bin.images import digest_of_path
+from bin.record import QueueRecord
+
+REPLAY_BATCH = 100
+
+
+def _datetime(value: str) -> datetime:
+    return datetime.fromisoformat(value)
+
+
+def replay_records(
+    history: JobHistory,
+    since: datetime,
+    until: datetime,
+    status: Optional[str] = "printed",
+    printkey: Optional[str] = None,
+) -> Iterator[QueueRecord]:
+    for _, job_status, record in history.between(since, until):
+        if status and job_status != status:
+            continue
+        if printkey and record.printkey != printkey:
+            continue
+        yield record
+
+
+def enqueue_copy(record: QueueRecord) -> Optional[str]:
+    """
+    Queue a finished job again as a new message. Returns None, queueing
+    nothing, if the job's image is no longer stored.
+    """
+    data = record.to_message().to_record()
+    data.pop("dt_printed", None)
+    data.pop("idempotency_key", None)
+    data.update(id=str(uuid.uuid4()), dt_received=datetime.now().isoformat())
+    if image_path := record.image_path:
+        digest = digest_of_path(image_path)
+        if digest is None:
+            # Per-message image from before content addressing
+            if not Path(image_path).exists():
+                return None
+        elif acquire_image(digest):
+            # Released or pruned already: the file is gone, drop our reference
+            release_image(image_path)
+            return None
+    return store_message(data)
+
+
+def replay_to_server(records: Iterator[QueueRecord], target: str, api_key: Optional[str]) -> Counter:
+    """Send finished jobs to another print server; replies counted by status."""
+    from printer_client import PrinterClient
+
+    host, _, port = target.rpartition(":")
+    statuses: Counter = Counter()
+    with PrinterClient(host or "localhost", int(port), api_key) as client:
+        batch: List[dict] = []
+
+        def flush() -> None:
+            for response in client.send_batch(batch):
+                statuses[response.status.value] += 1
+            batch.clear()
+
+        for record in records:
+            message = record.to_message()
+            image = message.image_path if message.image_path and Path(message.image_path).exists() else None
+            batch.append(
+                {
+                    "text": message.text,
+                    "image": image,
+                    "sender": message.sender,
+                    "custom_template": message.custom_template,
+                    "cut": message.cut,
+                    # Replaying the same range twice prints each job once
+                    "idempotency_key": f"replay:{message.id}",
+                }
+            )
+            if len(batch) >= REPLAY_BATCH:
+                flush()
+        if batch:
+            flush()
+    return statuses
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Export, import and replay the print queue")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    export = commands.add_parser("export", help="write the queue and its images to an archive")
+    export.add_argument("archive", type=Path, help="output file (gzip JSON lines)")
+
+    load = commands.add_parser("import", help="add the messages in an archive to the queue")
+    load.add_argument("archive", type=Path)
+    load.add_argument("--batch-size", type=int, default=1000)
+
+    replay = commands.add_parser("replay", help="print finished jobs from the history again")
+    replay.add_argument("--since", type=_datetime, required=True, help="ISO date or date-time")
+    replay.add_argument("--until", type=_datetime, help="ISO date or date-time (default: now)")
+    replay.add_argument("--status", choices=("printed", "failed", "all"), default="printed")
+    replay.add_argument("--printkey", help="only jobs from this print-key")
+    target = replay.add_mutually_exclusive_group(required=True)
+    target.add_argument("--to", metavar="HOST:PORT", help="send to another print server")
+    target.add_argument("--enqueue", action="store_true", help="queue again on this printer")
+    target.add_argument("--list", action="store_true", help="only list the jobs")
+    replay.add_argument("--api-key", help="print-key for the other server")
+
+    args = parser.parse_args()
+
+    if args.command == "export":
+        print(f"Exported {export_queue(args.archive)} messages to {args.archive}")
+    elif args.command == "import":
+        result = import_queue(args.archive, args.batch_size)
+        print(
+            f"Imported {result.stored} messages ({result.skipped} already queued), "
+            f"{result.images} new images"
+        )
+    else:
+        from bin.load import CONFIG
+
+        history = JobHistory.from_config(CONFIG.get("queue", {})) or JobHistory()
+        until = args.until or datetime.now() + timedelta(seconds=1)
+        status = None if args.status == "all" else args.status
+        records = replay_records(history, args.since, until, status, args.printkey)
+        if args.list:
+            for record in records:
+                print(f"{record.id}  {record.printkey or '-':12}  {record.field('text')[:40]!r}")
+        elif args.enqueue:
+            count = 0
+            for record in records:
+                if enqueue_copy(record):
+                    count += 1
+                else:
+                    print(f"Skipping {record.id}: its image is no longer stored")
+            print(f"Queued {count} jobs again")
+        else:
+            statuses = replay_to_server(records, args.to, args.api_key)
+            print(", ".join(f"{n} {status}" for status, n in statuses.items()) or "No jobs found")
+
+
+if __name__ == "__main__":
+    main()
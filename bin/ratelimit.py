@@ -0,0 +1,63 @@
+import threading
+import time
+from typing import Any, Dict, Optional
+
+
+class TokenBucket:
+    def __init__(self, per_minute: float, burst: int) -> None:
+        self.rate = per_minute / 60
+        self.burst = max(1, burst)
+        self.tokens = float(self.burst)
+        self.updated = time.monotonic()
+
+    def take(self, cost: float = 1) -> float:
+        """Take `cost` tokens; returns 0 on success, else seconds until possible."""
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= cost:
+            self.tokens -= cost
+            return 0.0
+        if self.rate <= 0:
+            return float("inf")
+        return (cost - self.tokens) / self.rate
+
+
+class RateLimiter:
+    """Token buckets keyed by printkey name, kept in memory."""
+
+    def __init__(self) -> None:
+        self._buckets: Dict[str, TokenBucket] = {}
+        self._lock = threading.Lock()
+
+    def check(self, name: str, limit: Optional[Dict[str, Any]]) -> float:
+        """
+        Charge one message to `name`. Returns 0 if allowed, otherwise the
+        number of seconds after which the client may retry.
+        """
+        if not limit:
+            return 0.0
+        per_minute = float(limit.get("per_minute", 0))
+        burst = int(limit.get("burst", 1))
+        with self._lock:
+            bucket = self._buckets.get(name)
+            if bucket is None or (bucket.rate, bucket.burst) != (per_minute / 60, burst):
+                bucket = self._buckets[name] = TokenBucket(per_minute, burst)
+            return bucket.take()
+
+
+def parse_rate_limit(line: str) -> Optional[Dict[str, Any]]:
+    """
+    Parse a printkey file rate line: ``<per_minute>[,<burst>]``. Raises
+    ValueError for anything else, including rates or bursts below 1.
+    """
+    parts = [p.strip() for p in line.split(",") if p.strip()]
+    if not parts:
+        return None
+    if len(parts) > 2:
+        raise ValueError(f"expected <per_minute>[,<burst>], got {line.strip()!r}")
+    per_minute = float(parts[0])
+    burst = int(parts[1]) if len(parts) > 1 else max(1, int(per_minute))
+    if not per_minute > 0 or burst < 1:
+        raise ValueError(f"rate and burst must be positive, got {line.strip()!r}")
+    return {"per_minute": per_minute, "burst": burst}
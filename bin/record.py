@@ -0,0 +1,218 @@
+from __future__ import annotations
+
+import base64
+import struct
+import uuid
+from datetime import datetime
+from typing import Optional
+
+from bin.message import Message
+
+FLAG_CUT = 0x01
+FLAG_IMAGE = 0x02
+FLAG_CUSTOM_TEMPLATE = 0x04
+
+
+class RecordLayout:
+    """
+    Binary layout of one record version.
+
+    Every header starts with version, flags, id (uuid bytes) and the
+    dt_sent/dt_received/dt_printed timestamps (epoch microseconds, 0 = unset),
+    then the version's extra fixed-size ``header_fields`` and one length per
+    body field. The variable-length body fields are stored back to back after
+    the header, in ``body_fields`` order.
+    """
+
+    def __init__(
+        self,
+        version: int,
+        body_fields: tuple[str, ...],
+        header_fields: tuple[tuple[str, str], ...] = (),
+    ) -> None:
+        fixed = "<BB16sqqq" + "".join(fmt for _, fmt in header_fields)
+        pad = -(struct.calcsize(fixed) + 4 * len(body_fields)) % 3
+        self.version = version
+        self.body_fields = body_fields
+        self.header_index = {name: 6 + i for i, (name, _) in enumerate(header_fields)}
+        self.lengths_at = 6 + len(header_fields)
+        self.struct = struct.Struct(f"{fixed}{len(body_fields)}I{pad}x")
+        # The header is kept a multiple of 3 bytes so its base64 prefix decodes
+        # on its own, which lets queue scans skip the body entirely.
+        self.b64_len = self.struct.size // 3 * 4
+
+
+_V2_BODY = ("text", "sender", "image_path", "custom_template", "printkey")
+_V4_BODY = _V2_BODY + ("idempotency_key",)
+
+LAYOUTS: dict[int, RecordLayout] = {
+    1: RecordLayout(1, ("text", "sender", "image_path", "custom_template")),
+    2: RecordLayout(2, _V2_BODY),
+    3: RecordLayout(3, _V2_BODY, (("priority", "b"),)),
+    4: RecordLayout(4, _V4_BODY, (("priority", "b"),)),
+}
+RECORD_VERSION = max(LAYOUTS)
+
+
+def _dt_to_epoch(value: Optional[datetime]) -> int:
+    return int(value.timestamp() * 1_000_000) if value else 0
+
+
+def _epoch_to_dt(value: int) -> Optional[datetime]:
+    if not value:
+        return None
+    try:
+        return datetime.fromtimestamp(value / 1_000_000)
+    except (OverflowError, ValueError, OSError):
+        # Older records may hold times that cannot be read back; treat as unset
+        return None
+
+
+def _storable_epoch(name: str, value: Optional[datetime]) -> int:
+    """Encode a timestamp, making sure it decodes back when the job is read."""
+    if not value:
+        return 0
+    try:
+        epoch = _dt_to_epoch(value)
+    except (OverflowError, ValueError, OSError):
+        epoch = 0
+    if not -(2**63) <= epoch < 2**63 or _epoch_to_dt(epoch) is None:
+        raise ValueError(f"{name} is out of range: {value.isoformat()}")
+    return epoch
+
+
+def _id_to_bytes(message_id: str) -> bytes:
+    try:
+        return uuid.UUID(message_id).bytes
+    except ValueError:
+        raise ValueError(f"Message id is not a UUID: {message_id}")
+
+
+def encode_message(msg: Message) -> str:
+    """Pack a message into a compact base64 record for the queue."""
+    layout = LAYOUTS[RECORD_VERSION]
+    body = [(getattr(msg, name) or "").encode("utf-8") for name in layout.body_fields]
+
+    flags = 0
+    if msg.cut:
+        flags |= FLAG_CUT
+    if msg.image_path:
+        flags |= FLAG_IMAGE
+    if msg.custom_template:
+        flags |= FLAG_CUSTOM_TEMPLATE
+
+    header = layout.struct.pack(
+        layout.version,
+        flags,
+        _id_to_bytes(msg.id),
+        _storable_epoch("dt_sent", msg.dt_sent),
+        _storable_epoch("dt_received", msg.dt_received),
+        _storable_epoch("dt_printed", msg.dt_printed),
+        *(getattr(msg, name) for name in layout.header_index),
+        *(len(b) for b in body),
+    )
+    return base64.b64encode(header + b"".join(body)).decode("ascii")
+
+
+class QueueRecord:
+    """
+    Read-only view over an encoded queue record.
+
+    Only the fixed header is decoded up front; the body (text, template, ...)
+    is decoded the first time one of its fields is needed.
+    """
+
+    __slots__ = ("raw", "_layout", "_header", "_body")
+
+    def __init__(self, raw: str) -> None:
+        self.raw = raw
+        version = base64.b64decode(raw[:4])[0]
+        layout = LAYOUTS.get(version)
+        if layout is None:
+            raise ValueError(f"Unsupported queue record version: {version}")
+        self._layout = layout
+        self._header = layout.struct.unpack(base64.b64decode(raw[: layout.b64_len]))
+        self._body: Optional[dict[str, str]] = None
+
+    @property
+    def id(self) -> str:
+        return str(uuid.UUID(bytes=self._header[2]))
+
+    @property
+    def flags(self) -> int:
+        return self._header[1]
+
+    @property
+    def cut(self) -> bool:
+        return bool(self.flags & FLAG_CUT)
+
+    @property
+    def has_image(self) -> bool:
+        return bool(self.flags & FLAG_IMAGE)
+
+    @property
+    def priority(self) -> int:
+        index = self._layout.header_index.get("priority")
+        return self._header[index] if index is not None else 0
+
+    @property
+    def received_us(self) -> int:
+        """Receive time as epoch microseconds (0 when unknown); cheap to sort on."""
+        return self._header[4]
+
+    @property
+    def dt_received(self) -> Optional[datetime]:
+        return _epoch_to_dt(self._header[4])
+
+    @property
+    def size(self) -> int:
+        """Encoded size of the record body in bytes."""
+        return sum(self._header[self._layout.lengths_at :])
+
+    def field(self, name: str) -> str:
+        """Return a body field, or "" if this record version does not carry it."""
+        if self._body is None:
+            data = base64.b64decode(self.raw)[self._layout.struct.size :]
+            body: dict[str, str] = {}
+            offset = 0
+            lengths = self._header[self._layout.lengths_at :]
+            for key, length in zip(self._layout.body_fields, lengths):
+                body[key] = data[offset : offset + length].decode("utf-8")
+                offset += length
+            self._body = body
+        return self._body.get(name, "")
+
+    @property
+    def image_path(self) -> Optional[str]:
+        return self.field("image_path") if self.has_image else None
+
+    @property
+    def printkey(self) -> Optional[str]:
+        return self.field("printkey") or None
+
+    @property
+    def idempotency_key(self) -> Optional[str]:
+        fields = self._layout.body_fields
+        if "idempotency_key" not in fields:
+            return None
+        # Most jobs carry no key, so their body is not decoded for it
+        if not self._header[self._layout.lengths_at + fields.index("idempotency_key")]:
+            return None
+        return self.field("idempotency_key")
+
+    def to_message(self) -> Message:
+        h = self._header
+        return Message(
+            id=self.id,
+            text=self.field("text"),
+            dt_sent=_epoch_to_dt(h[3]),
+            dt_received=_epoch_to_dt(h[4]),
+            dt_printed=_epoch_to_dt(h[5]),
+            image_path=self.image_path,
+            sender=self.field("sender") or None,
+            cut=self.cut,
+            custom_template=self.field("custom_template") or None,
+            printkey=self.printkey,
+            priority=self.priority,
+            idempotency_key=self.idempotency_key,
+        )
@@ -0,0 +1,88 @@
+from collections import deque
+from typing import Any, Callable, Deque, Dict, Optional, Union
+from bin.queue_index import IndexEntry, QueueIndex
+
+
+class FifoScheduler:
+    def pick(self, heads: Dict[str, IndexEntry]) -> Optional[IndexEntry]:
+        return min(heads.values(), key=lambda e: e.arrival) if heads else None
+
+
+class FairScheduler:
+    """
+    Deficit round robin across printkeys.
+
+    Every key with queued messages takes turns; at the start of its turn a key
+    is credited `quantum` and may print messages while its credit covers their
+    cost. A key whose queue runs empty loses its credit, so a flood from one
+    key delays everyone else by at most one turn.
+    """
+
+    def __init__(self, quantum: int = 1, image_cost: int = 1) -> None:
+        self.quantum = max(1, quantum)
+        self.image_cost = max(1, image_cost)
+        self._order: Deque[str] = deque()
+        self._deficit: Dict[str, int] = {}
+        self._turn: Optional[str] = None
+
+    def cost(self, entry: IndexEntry) -> int:
+        return self.image_cost if entry.has_image else 1
+
+    def pick(self, heads: Dict[str, IndexEntry]) -> Optional[IndexEntry]:
+        for key in list(self._order):
+            if key not in heads:
+                self._order.remove(key)
+                del self._deficit[key]
+        for key in sorted(heads, key=lambda k: heads[k].arrival):
+            if key not in self._deficit:
+                self._order.append(key)
+                self._deficit[key] = 0
+
+        if not self._order:
+            return None
+
+        while True:
+            key = self._order[0]
+            if self._turn != key:
+                self._turn = key
+                self._deficit[key] += self.quantum
+            head = heads[key]
+            cost = self.cost(head)
+            if self._deficit[key] >= cost:
+                self._deficit[key] -= cost
+                return head
+            self._order.rotate(-1)
+            self._turn = None
+
+
+LaneScheduler = Union[FifoScheduler, FairScheduler]
+
+
+class PriorityScheduler:
+    """
+    Always serves the highest priority lane first; within a lane, messages
+    are picked by that lane's own FIFO or fair scheduler.
+    """
+
+    def __init__(self, factory: Callable[[], LaneScheduler]) -> None:
+        self._factory = factory
+        self._lanes: Dict[int, LaneScheduler] = {}
+
+    def pick(self, index: QueueIndex) -> Optional[IndexEntry]:
+        priority, heads = index.top_lane()
+        if priority is None:
+            return None
+        if priority not in self._lanes:
+            self._lanes[priority] = self._factory()
+        return self._lanes[priority].pick(heads)
+
+
+def scheduler_from_config(config: Dict[str, Any]) -> PriorityScheduler:
+    if config.get("scheduling", "fair") == "fifo":
+        return PriorityScheduler(FifoScheduler)
+    return PriorityScheduler(
+        lambda: FairScheduler(
+            quantum=config.get("quantum", 1),
+            image_cost=config.get("image_cost", 1),
+        )
+    )
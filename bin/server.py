@@ -1,45 +1,74 @@
 import socket
 import threading
+import time
 import json
 import base64
+import re
 import uuid
-from datetime import datetime
-from pathlib import Path
-from PIL import Image
-from io import BytesIO
-from bin.load import CONFIG, load_named_api_keys
-from emoji import demojize
+from datetime import datetime, timedelta
+from bin.load import CONFIG, load_named_api_keys, load_template_by_name
 from bin.db import (
     store_message,
-    load_oldest_message,
-    delete_message_by_id,
-    load_all_messages,
     set_message_processing,
     get_message_processing,
+    acquire_image,
+    release_image,
+    queue_stats,
+    queued_with_idempotency_keys,
 )
-from bin.message import Message
+from bin import profiler
+from bin.admission import LazyPrintTimes, admit
+from bin.dedupe import RecentJobs, idempotency_job_key, job_key
+from bin.images import image_digest, path_for_digest, process_image, write_image
 from bin.logger import logging
-from prometheus_client import start_http_server, Gauge, Counter
-from typing import Tuple, List, Optional
+from bin.message import Message
+from bin.ratelimit import RateLimiter
+from bin.status import LiveStatus
+from bin.text import TextPipeline, TextProcessor
+from bin.metrics import (
+    PRINTER_UP,
+    PRINTER_ERRORS,
+    PRINTER_RATE_LIMITED,
+    PRINTER_DUPLICATES,
+    PRINTER_REJECTED,
+    PRINTER_DEGRADED,
+    PRINTER_IMAGE_DEDUPED,
+    PRINTER_QUEUE_ETA,
+    PRINTER_QUEUE_SIZE,
+    start_metrics_server,
+)
+from typing import Any, Dict, Tuple, List, Optional
 
-IMG_DATA_DIR = Path("data/img/tmp")
-IMG_DATA_DIR.mkdir(parents=True, exist_ok=True)
+RATE_LIMITER = RateLimiter()
+PRINT_TIMES = LazyPrintTimes()
+MAX_PRIORITY = 9
+PRINTKEYS_REFRESH_S = 1.0
 
-PRINTER_UP = Gauge("printer_server_up", "1 = server main loop running")
-PRINTER_ERRORS = Counter("printer_server_errors_total", "Total unhandled server errors")
-PRINTER_QUEUE_SIZE = Gauge(
-    "printer_server_queue_length", "Current number of unprocessed messages"
-)
+_printkeys: Dict[str, Tuple[str, dict]] = {}
+_printkeys_loaded = float("-inf")
+_printkeys_lock = threading.Lock()
+
+
+def demojize(text: str) -> str:
+    # emoji ships large data tables; only load them once text needs them
+    from emoji import demojize as _demojize
 
-text_processors = [
+    return _demojize(text)
+
+
+# Run, in order, on text the transliteration table could not make printable
+text_processors: List[TextProcessor] = [
     demojize,
 ]
 
+_text_pipeline: Optional[TextPipeline] = None
+
 
 def process_text(text: str) -> str:
-    for processor in text_processors:
-        text = processor(text)
-    return text
+    global _text_pipeline
+    if _text_pipeline is None:
+        _text_pipeline = TextPipeline.from_config(CONFIG["printer"], text_processors)
+    return _text_pipeline(text)
 
 
 def is_within_schedule() -> bool:
@@ -64,159 +93,392 @@ def is_within_schedule() -> bool:
         return True
 
 
-def save_image_from_base64(image_b64: str, message_id: str) -> str:
+def seconds_until_schedule() -> float:
+    """Seconds until the schedule window opens again (0 when inside it)."""
+    if is_within_schedule():
+        return 0.0
+    schedule = CONFIG.get("printer", {}).get("schedule", {})
+    start_time = datetime.strptime(schedule.get("start", "00:00"), "%H:%M").time()
+    now = datetime.now()
+    start = datetime.combine(now.date(), start_time)
+    if start <= now:
+        start += timedelta(days=1)
+    return (start - now).total_seconds()
+
+
+def save_image_from_base64(image_b64: str) -> str:
+    """
+    Store an image by content hash and return its path. The caller holds a
+    reference on the stored image afterwards (see release_image).
+    """
     config = CONFIG["printer"]["image"]
-    max_width = config["max_width"]
-
     image_data = base64.b64decode(image_b64)
-    image = Image.open(BytesIO(image_data))
+    digest = image_digest(image_data, config)
+    path = path_for_digest(digest)
+    if acquire_image(digest):
+        try:
+            write_image(process_image(image_data, config), path)
+        except Exception:
+            release_image(str(path))
+            raise
+    else:
+        PRINTER_IMAGE_DEDUPED.inc()
+    return str(path)
+
+
+def printkeys() -> Dict[str, Tuple[str, dict]]:
+    """
+    {api_key: (name, record)}, re-read from data/printkeys at most once per
+    PRINTKEYS_REFRESH_S, so authenticating a request does not read files.
+    """
+    global _printkeys, _printkeys_loaded
+    with _printkeys_lock:
+        if time.monotonic() - _printkeys_loaded >= PRINTKEYS_REFRESH_S:
+            _printkeys = {
+                rec["key"]: (name, rec) for name, rec in load_named_api_keys().items()
+            }
+            _printkeys_loaded = time.monotonic()
+        return _printkeys
+
+
+def find_printkey(
+    data: dict,
+) -> Optional[Tuple[str, List[str], Optional[Dict[str, Any]]]]:
+    found = printkeys().get(data.get("api_key"))  # type: ignore[arg-type]
+    if found is None:
+        return None
+    name, rec = found
+    return name, rec.get("permissions", []), rec.get("rate_limit")
+
+
+def rate_limit_for(
+    key_limit: Optional[Dict[str, Any]], permissions: List[str]
+) -> Optional[Dict[str, Any]]:
+    if "unlimited" in permissions:
+        return None
+    if key_limit:
+        return key_limit
+    config = CONFIG["security"].get("rate_limit", {})
+    return config if config.get("enabled", False) else None
+
+
+def _summary_fields() -> Dict[str, Any]:
+    printer = CONFIG.get("printer", {})
+    return {
+        "name": printer.get("name", "Unknown"),
+        "charcode": printer.get("charcode", "CP858"),
+        "always_cut": printer.get("always_cut", False),
+        "allow_custom_template": printer.get("text", {}).get("allow_custom_template", False),
+        "text_limit": CONFIG.get("security", {}).get("text_limit", -1),
+        "schedule": printer.get("schedule", {}),
+        "currently_processing": False,
+        "printer": "connecting",
+        "current_job": None,
+        "queue_length": 0,
+        "queue_eta_s": 0,
+    }
+
+
+def _processing_fields() -> Dict[str, Any]:
+    # The flag can also be changed by other processes; one settings read a second
+    return {"currently_processing": get_message_processing() and is_within_schedule()}
+
+
+# What summary requests report, updated by the server and the worker
+STATUS = LiveStatus(_summary_fields, refresh=_processing_fields)
+
+
+def _queued_job_keys() -> List[Tuple[str, str, float]]:
+    window = CONFIG.get("queue", {}).get("dedupe", {}).get("window_s", 600)
+    now = time.time()
+    return [
+        (
+            idempotency_job_key(e.printkey or None, e.idempotency_key),
+            e.id,
+            window - (now - e.received_us / 1_000_000) if e.received_us else window,
+        )
+        for e in queued_with_idempotency_keys()
+    ]
 
-    image = image.convert("RGBA")
-    background = Image.new("RGBA", image.size, "WHITE")
-    background.alpha_composite(image)
 
-    image = background.convert("RGB").rotate(config["rotate"], expand=True)
-    if (
-        config["rotate_to_fit"]
-        and image.width > config["rotate_to_fit_threshold_factor"] * image.height
-    ):
-        image = image.rotate(90, expand=True)
-    new_height = int(max_width * image.height / image.width)
-    image = image.resize((max_width, new_height))
-    image_path = IMG_DATA_DIR / f"{message_id}.jpg"
-    image.save(image_path, "JPEG")
-    return str(image_path)
-
-
-def find_printkey(data: dict) -> Optional[Tuple[str, List[str]]]:
-    api_key = data.get("api_key")
-    for name, rec in load_named_api_keys().items():
-        if rec["key"] == api_key:
-            return name, rec.get("permissions", [])
-    return None
-
-
-def recv_one_line(sock, bufsize=4096, terminator=b"\n") -> bytes:
-    chunks = []
-    while True:
-        chunk = sock.recv(bufsize)
-        if not chunk:
-            break
-        chunks.append(chunk)
-        if terminator in chunk:
-            break
-    return b"".join(chunks)
-
-
-def summary() -> str:
-    return json.dumps(
+# Seeded from the queue, so a client retrying across a restart is still deduplicated
+RECENT_JOBS = RecentJobs(_queued_job_keys)
+
+
+def publish_queue_stats() -> None:
+    stats = queue_stats()
+    eta = PRINT_TIMES.eta(stats)
+    PRINTER_QUEUE_SIZE.set(stats.queued)
+    PRINTER_QUEUE_ETA.set(eta)
+    STATUS.update(queue_length=stats.queued, queue_eta_s=round(eta))
+
+
+def preview(data: dict) -> str:
+    """Render a message as it would print, without storing or printing it."""
+    from bin.printer.preview import PreviewPrinter, render_preview
+
+    config = CONFIG["printer"]
+    fmt = data.get("format", "text")
+    if fmt not in ("text", "png"):
+        raise ValueError("Preview format must be 'text' or 'png'.")
+    name = data.get("template") or config.get("template_name", "debug")
+    if not isinstance(name, str) or not re.fullmatch(r"\w+", name):
+        raise ValueError("Invalid template name.")
+    template = load_template_by_name(name)
+    if template is None:
+        raise ValueError(f"Unknown template '{name}'.")
+
+    message = Message.from_dict(
         {
-            "name": CONFIG.get("printer", {}).get("name", "Unknown"),
-            "charcode": CONFIG.get("printer", {}).get("charcode", "CP858"),
-            "always_cut": CONFIG.get("printer", {}).get("always_cut", False),
-            "allow_custom_template": CONFIG.get("printer", {})
-            .get("text", {})
-            .get("allow_custom_template", False),
-            "text_limit": CONFIG.get("security", {}).get("text_limit", -1),
-            "schedule": CONFIG.get("printer", {}).get("schedule", {}),
-            "currently_processing": get_message_processing() and is_within_schedule(),
-        },
-        indent=2,
+            **data,
+            "id": "preview",
+            "text": process_text(data.get("text") or ""),
+            "dt_received": datetime.now(),
+            "image_path": None,
+        }
     )
+    if data.get("image"):
+        # Kept in memory: previews never touch the image store
+        message.image_path = process_image(  # type: ignore[assignment]
+            base64.b64decode(data["image"]), config["image"]
+        )
+    rendered = render_preview(PreviewPrinter(config), message, template, fmt)
+    if isinstance(rendered, bytes):
+        rendered = base64.b64encode(rendered).decode()
+    return json.dumps({"format": fmt, "preview": rendered}, separators=(",", ":"))
 
 
 def handle_client(conn, addr):
+    """
+    Serve one connection. A request with "keep_alive": true leaves the
+    connection open for the next line (up to server.keep_alive_s idle), so
+    clients can reuse and pipeline connections; replies come in request order.
+    """
     log = logging.getLogger(__name__)
     log.info(f"Connection from {addr}")
+    keep_alive_s = CONFIG["server"].get("keep_alive_s", 0)
+    try:
+        reader = conn.makefile("rb")
+        while True:
+            raw = reader.readline()
+            if not raw.strip():
+                break
+            if not (handle_request(conn, addr, raw) and keep_alive_s):
+                break
+            conn.settimeout(keep_alive_s)
+    except (socket.timeout, ConnectionError):
+        pass
+    finally:
+        conn.close()
+
+
+def handle_request(conn, addr, raw: bytes) -> bool:
+    """Handle one request line. Returns whether the client wants to keep the connection."""
+    log = logging.getLogger(__name__)
+    keep_alive = False
     try:
-        raw = recv_one_line(conn)
         message_data = json.loads(raw.decode("utf-8").rstrip())
+        if not isinstance(message_data, dict):
+            raise ValueError("Request must be a JSON object.")
+        keep_alive = message_data.get("keep_alive") is True
+        respond(conn, addr, message_data)
+    except ValueError as ve:
+        log.warning(f"Client error from {addr}: {ve}")
+        conn.send(f"Error: {ve}\n".encode())
+    except Exception as e:
+        log.error(f"Unhandled error from {addr}: {e}")
+        PRINTER_ERRORS.inc()
+        conn.send(b"Error: An unexpected server error occurred.\n")
+    return keep_alive
+
+
+def respond(conn, addr, message_data: Dict[str, Any]) -> None:
+    log = logging.getLogger(__name__)
+    req_type = message_data.get("type", "message")
+    printkey_name: Optional[str] = None
+    permissions: List[str] = []
+    key_limit: Optional[Dict[str, Any]] = None
+
+    if not CONFIG["security"].get("allow_unauthenticated", False):
+        key_info = find_printkey(message_data)
+        if key_info is None:
+            log.info(f"{addr} was not authorized")
+            conn.send(b"Unauthorized.\n")
+            return
+        printkey_name, permissions, key_limit = key_info
+
+    if req_type == "summary":
+        conn.sendall(STATUS.summary())
+        log.info(
+            f"Sent summary to {addr} (key: {printkey_name or 'unauthenticated'})"
+        )
+        return
+
+    if req_type == "control":
+        if "control" not in permissions:
+            conn.send(b"Forbidden.\n")
+            log.info(f"{addr} tried control without permission")
+            return
+
+        raw_value = message_data.get("value")
 
-        req_type = message_data.get("type", "message")
-        printkey_name: Optional[str] = None
-        permissions: List[str] = []
-
-        if not CONFIG["security"].get("allow_unauthenticated", False):
-            key_info = find_printkey(message_data)
-            if key_info is None:
-                log.info(f"{addr} was not authorized")
-                conn.send(b"Unauthorized.\n")
-                return
-            printkey_name, permissions = key_info
-
-        if req_type == "summary":
-            conn.send(summary().encode() + b"\n")
-            log.info(
-                f"Sent summary to {addr} (key: {printkey_name or 'unauthenticated'})"
+        if isinstance(raw_value, dict) and ("profiler" in raw_value or "trace" in raw_value):
+            conn.sendall(
+                profiler.control(raw_value, CONFIG["server"].get("profiling", {})).encode()
+                + b"\n"
             )
+            log.info(f"Profiling control {raw_value} by key {printkey_name}")
             return
 
-        if req_type == "control":
-            if "control" not in permissions:
-                conn.send(b"Forbidden.\n")
-                log.info(f"{addr} tried control without permission")
-                return
-
-            raw_value = message_data.get("value")
-
-            if isinstance(raw_value, dict):
-                flag = raw_value.get("message_processing", None)
-            else:
-                flag = None
-
-            if not isinstance(flag, bool):
-                conn.send(b"Error: 'message_processing' must be true or false.\n")
-                log.warning(
-                    f"{addr} sent invalid control payload: {message_data.get('value')}"
-                )
-                return
-
-            set_message_processing(flag)
-            conn.send(b"Message processing updated.\n")
-            log.info(f"Message processing set to {flag} by key {printkey_name}")
+        if isinstance(raw_value, dict):
+            flag = raw_value.get("message_processing", None)
+        else:
+            flag = None
+
+        if not isinstance(flag, bool):
+            conn.send(b"Error: 'message_processing' must be true or false.\n")
+            log.warning(
+                f"{addr} sent invalid control payload: {message_data.get('value')}"
+            )
             return
 
+        set_message_processing(flag)
+        STATUS.update(currently_processing=flag and is_within_schedule())
+        conn.send(b"Message processing updated.\n")
+        log.info(f"Message processing set to {flag} by key {printkey_name}")
+        return
+
+    retry_after = RATE_LIMITER.check(
+        printkey_name or f"@{addr[0]}", rate_limit_for(key_limit, permissions)
+    )
+    if retry_after:
+        PRINTER_RATE_LIMITED.inc()
+        conn.send(f"Rate limited, retry after {max(retry_after, 1):.0f} s.\n".encode())
+        log.info(f"{addr} rate limited (key: {printkey_name or 'unauthenticated'})")
+        return
+
+    if req_type == "preview":
         text = message_data.get("text")
-        if text:
-            limit = CONFIG["security"].get("text_limit", -1)
-            if 0 < limit < len(text):
-                raise ValueError(f"Text too long. Limit is {limit} characters.")
-            message_data["text"] = process_text(text)
+        limit = CONFIG["security"].get("text_limit", -1)
+        if text and 0 < limit < len(text):
+            raise ValueError(f"Text too long. Limit is {limit} characters.")
+        conn.sendall(preview(message_data).encode() + b"\n")
+        log.info(f"Sent preview to {addr} (key: {printkey_name or 'unauthenticated'})")
+        return
+
+    message_data["printkey"] = printkey_name
+
+    priority = message_data.get("priority") or 0
+    if (
+        isinstance(priority, bool)
+        or not isinstance(priority, int)
+        or not 0 <= priority <= MAX_PRIORITY
+    ):
+        raise ValueError(f"Priority must be an integer from 0 to {MAX_PRIORITY}.")
+    if priority and "priority" not in permissions:
+        conn.send(b"Forbidden.\n")
+        log.info(f"{addr} tried priority {priority} without permission")
+        return
+
+    text = message_data.get("text")
+    if text:
+        limit = CONFIG["security"].get("text_limit", -1)
+        if 0 < limit < len(text):
+            raise ValueError(f"Text too long. Limit is {limit} characters.")
+
+    image = message_data.get("image")
+
+    if not image and not text:
+        raise ValueError("Message must contain either text or an image.")
+
+    idempotency_key = message_data.get("idempotency_key")
+    if idempotency_key is not None and (
+        not isinstance(idempotency_key, str) or not 0 < len(idempotency_key) <= 128
+    ):
+        raise ValueError("idempotency_key must be a string of 1 to 128 characters.")
+
+    # Before admission, so a retry of a stored job is answered as a duplicate
+    # rather than turned away as busy
+    message_id = str(uuid.uuid4())
+    dedupe = CONFIG.get("queue", {}).get("dedupe", {})
+    dedupe_key = job_key(
+        printkey_name, message_data, dedupe.get("identical_jobs", False)
+    )
+    if dedupe_key:
+        existing_id = RECENT_JOBS.claim(
+            dedupe_key, message_id, dedupe.get("window_s", 600)
+        )
+        if existing_id:
+            PRINTER_DUPLICATES.inc()
+            conn.send(b"Message already stored.\n")
+            log.info(f"Duplicate of {existing_id} from {addr} not stored")
+            return
 
-        image = message_data.get("image")
+    admission_config = CONFIG.get("queue", {}).get("admission", {})
+    if admission_config.get("reject_when_paused", False):
+        if not get_message_processing():
+            retry_after = admission_config.get("retry_after_s", 60)
+        else:
+            retry_after = seconds_until_schedule()
+        if retry_after:
+            PRINTER_REJECTED.inc()
+            if dedupe_key:
+                RECENT_JOBS.release(dedupe_key)
+            conn.send(f"Busy, retry after {retry_after:.0f} s.\n".encode())
+            log.info(f"{addr} rejected: printing is paused")
+            return
 
-        if not image and not text:
-            raise ValueError("Message must contain either text or an image.")
+    stats = queue_stats()
+    eta = PRINT_TIMES.eta(stats)
+    decision = admit(
+        admission_config, stats, eta, bool(image), bool(text), priority > 0
+    )
+    if not decision.accept:
+        PRINTER_REJECTED.inc()
+        if dedupe_key:
+            RECENT_JOBS.release(dedupe_key)
+        conn.send(f"Busy, retry after {decision.retry_after:.0f} s.\n".encode())
+        log.info(f"{addr} rejected: {decision.reason} ({stats.queued} queued)")
+        return
+    if decision.drop_image:
+        PRINTER_DEGRADED.inc()
+        image = message_data["image"] = None
+        log.info(f"Dropping image from {addr}: {decision.reason}")
+
+    try:
+        if text:
+            message_data["text"] = process_text(text)
 
         message_data["dt_received"] = datetime.now().isoformat()
-        message_id = str(uuid.uuid4())
         message_data["id"] = message_id
 
+        message_data["image_path"] = None
         if image:
-            path = save_image_from_base64(message_data["image"], message_id)
-            message_data["image_path"] = path
+            message_data["image_path"] = save_image_from_base64(image)
             message_data["image"] = None
-        else:
-            message_data["image_path"] = None
 
-        store_message(message_data)
+        try:
+            store_message(message_data)
+        except Exception:
+            if message_data["image_path"]:
+                release_image(message_data["image_path"])
+            raise
+    except Exception:
+        if dedupe_key:
+            RECENT_JOBS.release(dedupe_key)
+        raise
+    if decision.drop_image:
+        conn.send(b"Message stored without image.\n")
+    else:
         conn.send(b"Message stored.\n")
-        if printkey_name:
-            log.info(f"Message from {addr} with printkey {printkey_name} stored")
-        else:
-            log.info(f"Message from {addr} stored")
-    except ValueError as ve:
-        log.warning(f"Client error from {addr}: {ve}")
-        conn.send(f"Error: {ve}\n".encode())
-    except Exception as e:
-        log.error(f"Unhandled error from {addr}: {e}")
-        PRINTER_ERRORS.inc()
-        conn.send(b"Error: An unexpected server error occurred.\n")
-    finally:
-        conn.close()
+    publish_queue_stats()
+    if printkey_name:
+        log.info(f"Message from {addr} with printkey {printkey_name} stored")
+    else:
+        log.info(f"Message from {addr} stored")
 
 
-def start_server():
+def start_server(listening: Optional[threading.Event] = None):
     with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
         config = CONFIG["server"]
         host = config.get("host", "0.0.0.0")
@@ -224,35 +486,18 @@ def start_server():
         s.bind((host,port))
         s.listen()
         logging.getLogger(__name__).info(f"Server listening on {host}:{port}")
+        if listening:
+            listening.set()
         if CONFIG["server"].get("prometheus_enabled", False):
-            start_http_server(CONFIG["server"].get("prometheus_port", 9100))
+            profiling = CONFIG["server"].get("profiling", {})
+            start_metrics_server(
+                CONFIG["server"].get("prometheus_port", 9100),
+                profiler.debug_app(profiling)
+                if profiling.get("enabled", False) and profiling.get("http", False)
+                else None,
+            )
         PRINTER_UP.set(1)
         while True:
             conn, addr = s.accept()
             thread = threading.Thread(target=handle_client, args=(conn, addr))
             thread.start()
-
-
-def process_next_message(printer, template):
-    record = load_oldest_message()
-    PRINTER_QUEUE_SIZE.set(len(load_all_messages()))
-    if record:
-        message = Message.from_dict(record)
-        printer.print_message(message, template)
-        delete_message_by_id(message.id)
-        logging.getLogger(__name__).info(
-            f"Processed message: {message.id} from {message.sender}"
-        )
-
-
-def processing_loop(printer, template):
-    log = logging.getLogger(__name__)
-    log.info("Starting processing loop")
-    while True:
-        if get_message_processing() and is_within_schedule():
-            process_next_message(printer, template)
-
-
-def start_processing_loop(printer, template):
-    t = threading.Thread(target=processing_loop, args=(printer, template), daemon=True)
-    t.start()
@@ -0,0 +1,59 @@
+import json
+import os
+import threading
+from pathlib import Path
+from typing import Any, Dict, Optional, Tuple
+from filelock import FileLock
+
+SETTINGS_PATH = Path("data/settings.json")
+
+
+class SettingsStore:
+    """
+    Small JSON key/value store for runtime settings, kept apart from the queue.
+
+    Writers take a file lock and replace the file atomically, so readers never
+    see a partial file and need no lock at all. Reads are served from memory
+    until the file's mtime or size changes, which also picks up changes made
+    by other processes.
+    """
+
+    def __init__(self, path: Path) -> None:
+        self.path = path
+        self._lock_path = str(path.with_suffix(".lock"))
+        self._values: Dict[str, Any] = {}
+        self._version: Optional[Tuple[int, int]] = None
+        self._mutex = threading.Lock()
+
+    def get(self, name: str, default: Any = None) -> Any:
+        return self._load().get(name, default)
+
+    def set(self, name: str, value: Any) -> None:
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        with FileLock(self._lock_path):
+            values = {**self._read(), name: value}
+            tmp = self.path.with_suffix(".tmp")
+            tmp.write_text(json.dumps(values))
+            os.replace(tmp, self.path)
+        self._version = None
+
+    def _load(self) -> Dict[str, Any]:
+        try:
+            st = os.stat(self.path)
+            version: Optional[Tuple[int, int]] = (st.st_mtime_ns, st.st_size)
+        except FileNotFoundError:
+            version = None
+        if version != self._version or version is None:
+            with self._mutex:
+                self._values = self._read()
+                self._version = version
+        return self._values
+
+    def _read(self) -> Dict[str, Any]:
+        try:
+            return json.loads(self.path.read_text())
+        except FileNotFoundError:
+            return {}
+
+
+SETTINGS = SettingsStore(SETTINGS_PATH)
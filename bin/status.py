@@ -0,0 +1,64 @@
+import json
+import threading
+import time
+from typing import Any, Callable, Dict, Optional
+
+
+class LiveStatus:
+    """
+    The service state reported by summary requests, kept in memory.
+
+    The server and the worker push changes (processing flag, queue depth,
+    ETA, current job, printer state) with update(). The summary JSON is
+    serialized once per change and served as cached bytes, so answering a
+    summary takes no locks and touches no files. Values that depend on the
+    clock (the print schedule) are recomputed by `refresh` at most every
+    `refresh_interval_s`.
+    """
+
+    def __init__(
+        self,
+        initial: Callable[[], Dict[str, Any]],
+        refresh: Optional[Callable[[], Dict[str, Any]]] = None,
+        refresh_interval_s: float = 1.0,
+    ) -> None:
+        # `initial` is called on first use, so creating the object reads no config
+        self.initial = initial
+        self.refresh = refresh
+        self.refresh_interval_s = refresh_interval_s
+        self._fields: Optional[Dict[str, Any]] = None
+        self._lock = threading.Lock()
+        self._refresh_at = 0.0
+        self._summary = b""
+
+    def update(self, **changes: Any) -> None:
+        """Apply changes; re-serializes only if a value actually changed."""
+        with self._lock:
+            fields = self._load()
+            if all(k in fields and fields[k] == v for k, v in changes.items()):
+                return
+            fields.update(changes)
+            self._summary = self._serialize(fields)
+
+    def get(self, key: str, default: Any = None) -> Any:
+        with self._lock:
+            return self._load().get(key, default)
+
+    def summary(self) -> bytes:
+        """The summary as one line of compact JSON, newline included."""
+        if self.refresh and time.monotonic() >= self._refresh_at:
+            self._refresh_at = time.monotonic() + self.refresh_interval_s
+            self.update(**self.refresh())
+        elif self._fields is None:
+            self.update()
+        return self._summary
+
+    def _load(self) -> Dict[str, Any]:
+        if self._fields is None:
+            self._fields = dict(self.initial())
+            self._summary = self._serialize(self._fields)
+        return self._fields
+
+    @staticmethod
+    def _serialize(fields: Dict[str, Any]) -> bytes:
+        return json.dumps(fields, separators=(",", ":")).encode() + b"\n"
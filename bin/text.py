@@ -0,0 +1,138 @@
+import unicodedata
+from typing import Any, Callable, Dict, FrozenSet, Iterable, List, Optional
+from bin.printer.encoding import profile_code_pages, python_codec, resolve_pages
+
+TextProcessor = Callable[[str], str]
+
+# Characters with a common plain-text stand-in
+TRANSLITERATIONS: Dict[str, str] = {
+    "\u2018": "'",  # left single quote
+    "\u2019": "'",  # right single quote
+    "\u201a": ",",  # low single quote
+    "\u201b": "'",  # reversed single quote
+    "\u201c": '"',  # left double quote
+    "\u201d": '"',  # right double quote
+    "\u201e": '"',  # low double quote
+    "\u2032": "'",  # prime
+    "\u2033": '"',  # double prime
+    "\u2010": "-",  # hyphen
+    "\u2011": "-",  # non-breaking hyphen
+    "\u2012": "-",  # figure dash
+    "\u2013": "-",  # en dash
+    "\u2014": "--",  # em dash
+    "\u2015": "--",  # horizontal bar
+    "\u2026": "...",  # ellipsis
+    "\u2022": "*",  # bullet
+    "\u00a0": " ",  # no-break space
+    "\u2002": " ",  # en space
+    "\u2003": " ",  # em space
+    "\u2009": " ",  # thin space
+    "\u200b": "",  # zero width space
+    "\u200d": "",  # zero width joiner
+    "\ufe0f": "",  # emoji presentation selector
+    "\u2122": "TM",  # trade mark
+    "\u20ac": "EUR",  # euro sign
+}
+
+
+def charset(code_pages: Iterable[str]) -> FrozenSet[str]:
+    """All characters the given single-byte code pages can encode together."""
+    chars = {chr(i) for i in range(128)}
+    for name in code_pages:
+        if codec := python_codec(name):
+            chars.update(bytes(range(256)).decode(codec, errors="ignore"))
+    return frozenset(chars)
+
+
+def _emoji_names(style: str) -> Dict[str, str]:
+    from emoji import EMOJI_DATA  # type: ignore
+
+    if style == "strip":
+        return {e: "" for e in EMOJI_DATA if len(e) == 1}
+    return {e: data["en"] for e, data in EMOJI_DATA.items() if len(e) == 1}
+
+
+class TextPipeline:
+    """
+    Makes message text printable in the printer's code pages.
+
+    Text the code page can already encode (pure ASCII is the common case) is
+    returned untouched. Otherwise a precomputed transliteration table is
+    applied in a single `str.translate` pass, and only if that still leaves
+    unencodable characters do the slower `fallback` processors run.
+    """
+
+    def __init__(
+        self,
+        encodable: FrozenSet[str],
+        overrides: Optional[Dict[str, str]] = None,
+        emoji: str = "text",
+        fallback: Optional[List[TextProcessor]] = None,
+    ) -> None:
+        self.encodable = encodable
+        self.overrides = overrides or {}
+        self.emoji = emoji
+        self.fallback = fallback if fallback is not None else []
+        self._table: Optional[Dict[int, str]] = None
+
+    @classmethod
+    def from_config(
+        cls, config: Dict[str, Any], fallback: Optional[List[TextProcessor]] = None
+    ) -> "TextPipeline":
+        charcode = config.get("charcode", "CP858")
+        text_config = config.get("text", {})
+        overrides = text_config.get("transliterate", {}).get(charcode, {})
+        # Only the pages the printer's encoder will actually use count as printable
+        profile_pages = profile_code_pages(config.get("profile", "TM-T88III"))
+        if profile_pages is not None:
+            pages = [n for n, _ in resolve_pages(profile_pages, charcode, config.get("code_pages"))]
+        else:
+            pages = [charcode, *config.get("code_pages", [])]
+        return cls(
+            charset(pages),
+            overrides,
+            text_config.get("emoji", "text"),
+            fallback,
+        )
+
+    def printable(self, text: str) -> bool:
+        return text.isascii() or self.encodable.issuperset(text)
+
+    def __call__(self, text: str) -> str:
+        if self.printable(text):
+            return text
+        text = text.translate(self.table)
+        if self.printable(text):
+            return text
+        for processor in self.fallback:
+            text = processor(text)
+        return text
+
+    @property
+    def table(self) -> Dict[int, str]:
+        if self._table is None:
+            self._table = self._build_table()
+        return self._table
+
+    def _build_table(self) -> Dict[int, str]:
+        mapping: Dict[str, str] = {}
+        if self.emoji != "keep":
+            names = _emoji_names(self.emoji)
+            mapping.update({ch: rep for ch, rep in names.items() if ch not in self.encodable})
+
+        # Accented letters the code page lacks lose their accent
+        for cp in range(0xC0, 0x250):
+            ch = chr(cp)
+            if ch in self.encodable:
+                continue
+            base = "".join(
+                c for c in unicodedata.normalize("NFKD", ch) if not unicodedata.combining(c)
+            )
+            if base and self.encodable.issuperset(base):
+                mapping[ch] = base
+
+        mapping.update(
+            {ch: rep for ch, rep in TRANSLITERATIONS.items() if ch not in self.encodable}
+        )
+        mapping.update(self.overrides)
+        return {ord(ch): rep for ch, rep in mapping.items() if len(ch) == 1}
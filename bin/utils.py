@@ -1,2 +1,5 @@
 def encode_cp858(text: str) -> bytes:
+	if text.isascii():
+		# CP858 is ASCII-compatible; the ASCII codec is a plain copy
+		return text.encode('ascii')
 	return text.encode('cp858', errors='replace')
\ No newline at end of file
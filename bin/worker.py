@@ -0,0 +1,199 @@
+import dataclasses
+import threading
+import time
+from datetime import datetime
+from typing import Optional
+from bin.db import delete_message_by_id, get_message_processing, load_next_message
+from bin.history import JobHistory
+from bin.load import CONFIG
+from bin.logger import logging
+from bin.message import Message
+from bin.metrics import (
+    PRINTER_ERRORS,
+    PRINTER_JOB_RETRIES,
+    PRINTER_JOBS_FAILED,
+    PRINTER_JOBS_PRINTED,
+    PRINTER_RECONNECTS,
+    PRINTER_STATE,
+)
+from bin.printer.printer import PrintInterrupted, Printer
+from bin.record import QueueRecord
+from bin.scheduler import scheduler_from_config
+from bin.server import PRINT_TIMES, STATUS, is_within_schedule, publish_queue_stats
+
+IDLE_POLL_S = 0.1
+
+
+@dataclasses.dataclass
+class Job:
+    record: QueueRecord
+    message: Message
+    completed: int = 0
+    attempts: int = 0
+
+
+class PrinterWorker:
+    """
+    Supervises the printer and drains the queue.
+
+    Errors never end the worker: a failed job is kept, the printer is
+    reconnected with exponential backoff, and the job resumes after the last
+    action that reached the printer. A job that keeps failing is dropped after
+    `retry.max_attempts`.
+    """
+
+    def __init__(self, printer: Printer, template) -> None:
+        self.printer = printer
+        self.template = template
+        self.config = printer.config
+        self.scheduler = scheduler_from_config(CONFIG.get("queue", {}))
+        self.history = JobHistory.from_config(CONFIG.get("queue", {}))
+        self.job: Optional[Job] = None
+        self._last_health_check = time.monotonic()
+
+    def run(self) -> None:
+        log = logging.getLogger(__name__)
+        log.info("Starting processing loop")
+        publish_queue_stats()
+        if self.printer.ready.is_set():
+            self.set_state("ready")
+        while True:
+            try:
+                self.step()
+            except Exception as e:
+                log.exception(f"Processing loop error: {e}")
+                PRINTER_ERRORS.inc()
+                time.sleep(1)
+
+    def step(self) -> None:
+        if not self.printer.ready.is_set():
+            self.connect()
+            return
+        if get_message_processing() and is_within_schedule():
+            if self.process_next_message():
+                return
+        # Picks up messages queued by other processes (queuectl import)
+        publish_queue_stats()
+        self.check_health()
+        # The queue index is in memory, so don't spin while idle
+        time.sleep(IDLE_POLL_S)
+
+    def connect(self) -> None:
+        retry = self.config.get("retry", {})
+        initial, maximum = retry.get("initial_delay_s", 1), retry.get("max_delay_s", 60)
+        started = time.monotonic()
+        if not hasattr(self.printer, "printer"):
+            self.set_state("connecting")
+            self.printer.connect_with_retry(initial, maximum)
+        else:
+            self.set_state("reconnecting")
+            PRINTER_RECONNECTS.inc()
+            self.printer.reconnect(initial, maximum)
+        self.set_state("ready")
+        logging.getLogger(__name__).info(
+            f"Printer ready after {(time.monotonic() - started) * 1000:.0f} ms"
+        )
+
+    @staticmethod
+    def set_state(state: str) -> None:
+        PRINTER_STATE.state(state)
+        STATUS.update(printer=state)
+
+    def check_health(self) -> None:
+        interval = self.config.get("health_check", {}).get("interval_s", 30)
+        if not interval or time.monotonic() - self._last_health_check < interval:
+            return
+        self._last_health_check = time.monotonic()
+        if not self.printer.is_healthy():
+            logging.getLogger(__name__).warning(
+                f"Health check failed for {self.printer.name}; reconnecting"
+            )
+            self.printer.disconnect()
+
+    def next_job(self) -> Optional[Job]:
+        while self.job is None:
+            record = load_next_message(self.scheduler)
+            if record is None:
+                break
+            try:
+                message = record.to_message()
+            except Exception as e:
+                # Retrying cannot fix a record that does not decode
+                logging.getLogger(__name__).error(
+                    f"Dropping message {record.id}: cannot decode record: {e}"
+                )
+                PRINTER_JOBS_FAILED.inc()
+                self.retire(record, "failed")
+                continue
+            # Fix the print time now, so a resumed job prints the same header
+            message.dt_printed = message.dt_printed or datetime.now()
+            self.job = Job(record, message)
+        return self.job
+
+    def process_next_message(self) -> bool:
+        job = self.next_job()
+        if job is None:
+            return False
+
+        log = logging.getLogger(__name__)
+        message = job.message
+        job.attempts += 1
+        if job.completed:
+            PRINTER_JOB_RETRIES.inc()
+            log.info(f"Resuming message {message.id} at action {job.completed}")
+        STATUS.update(
+            current_job={
+                "id": message.id,
+                "attempt": job.attempts,
+                "started": datetime.now().isoformat(timespec="seconds"),
+            }
+        )
+
+        started = time.monotonic()
+        try:
+            # build_actions rewrites the message text, so every attempt gets a copy
+            self.printer.print_message(
+                dataclasses.replace(message), self.template, resume_from=job.completed
+            )
+        except Exception as e:
+            # Anything else (a bug, bad data) counts as a failed attempt too,
+            # so one bad job cannot hold up the queue
+            if isinstance(e, PrintInterrupted):
+                job.completed = e.completed
+            log.error(f"Printing message {message.id} failed: {e}")
+            PRINTER_ERRORS.inc()
+            max_attempts = self.config.get("retry", {}).get("max_attempts", 5)
+            if job.attempts >= max_attempts:
+                log.error(f"Dropping message {message.id} after {job.attempts} attempts")
+                PRINTER_JOBS_FAILED.inc()
+                self.finish(job, "failed")
+            self.printer.disconnect()
+            return True
+
+        PRINT_TIMES.observe(job.record.has_image, time.monotonic() - started)
+        PRINTER_JOBS_PRINTED.inc()
+        self.finish(job)
+        log.info(f"Processed message: {message.id} from {message.sender}")
+        return True
+
+    def finish(self, job: Job, status: str = "printed") -> None:
+        self.retire(job.record, status)
+
+    def retire(self, record: QueueRecord, status: str) -> None:
+        """Log a job to the history and remove it from the queue."""
+        if self.history:
+            try:
+                self.history.record(record, status)
+            except (OSError, ValueError) as e:
+                logging.getLogger(__name__).error(f"Could not log message {record.id}: {e}")
+        delete_message_by_id(record.id)
+        self.job = None
+        STATUS.update(current_job=None)
+        publish_queue_stats()
+
+
+def start_processing_loop(printer: Printer, template) -> PrinterWorker:
+    worker = PrinterWorker(printer, template)
+    t = threading.Thread(target=worker.run, name="worker", daemon=True)
+    t.start()
+    return worker
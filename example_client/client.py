@@ -1,46 +1,21 @@
-import socket
-import json
-import base64
-from pathlib import Path
 import os
+import sys
+from pathlib import Path
 
-SERVER_HOST = "0.0.0.0"
-SERVER_PORT = 9000
-BUF_SIZE     = 4096
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
 
-def _read_until_newline(sock: socket.socket, bufsize=BUF_SIZE) -> bytes:
-    chunks = []
-    while True:
-        chunk = sock.recv(bufsize)
-        if not chunk:
-            break
-        chunks.append(chunk)
-        if b'\n' in chunk:
-            break
-    return b''.join(chunks)
+from printer_client import PrinterClient  # noqa: E402
 
-def send_message(sender,
-                 text,
-                 image_path=None,
-                 api_key=None):
-    message = {
-        "sender": sender,
-        "text": text,
-    }
-    if api_key:
-        message["api_key"] = api_key
+SERVER_HOST = os.environ.get("PRINTER_HOST", "localhost")
+SERVER_PORT = int(os.environ.get("PRINTER_PORT", "9000"))
+API_KEY = os.environ.get("PRINTER_API_KEY")
 
-    if image_path:
-        message["image"] = base64.b64encode(
-            Path(image_path).read_bytes()
-        ).decode()
 
-    wire = json.dumps(message, separators=(",", ":")).encode() + b"\n"
+def send_message(sender, text, image_path=None, api_key=API_KEY):
+    with PrinterClient(SERVER_HOST, SERVER_PORT, api_key) as client:
+        reply = client.send_message(text, image_path, sender=sender)
+        print(f"[Server response] {reply.text}")
 
-    with socket.create_connection((SERVER_HOST, SERVER_PORT)) as sock:
-        sock.sendall(wire)
-        raw = _read_until_newline(sock)
-        reply = raw.strip().decode()
-        print(f"[Server response] {reply}")
 
-send_message("Client", "<center>\\<b\\>Hello from client!\\</b\\></center>")
\ No newline at end of file
+if __name__ == "__main__":
+    send_message("Client", "<center>\\<b\\>Hello from client!\\</b\\></center>")
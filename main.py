@@ -2,23 +2,48 @@ import logging
 import threading
 from bin.load import CONFIG, load_template_by_name
 import time
-from bin.logger import setup_logging
+from bin.logger import PhaseTimer, setup_logging
 from bin.printer.printer import Printer
-from bin.server import start_processing_loop, start_server
+from bin.db import count_messages
+from bin.server import start_server
+from bin.worker import start_processing_loop
+
 
 if __name__ == "__main__":
-    setup_logging()
-    logging.getLogger(__name__).info("Starting")
+    timer = PhaseTimer()
+    with timer.phase("config and logging"):
+        setup_logging()
+    log = logging.getLogger(__name__)
+    log.info("Starting")
 
-    printer = Printer(CONFIG["printer"])
-    template = load_template_by_name(CONFIG["printer"].get("template_name","debug"))
+    # In fast-start mode the server accepts and queues messages right away,
+    # while the processing worker connects the printer in the background.
+    fast_start = CONFIG["system"].get("fast_start", False)
 
-    start_processing_loop(printer, template)
+    printer = Printer(CONFIG["printer"], connect=False)
+    if not fast_start:
+        with timer.phase("printer"):
+            printer.connect()
+            printer.initialize()
+
+    with timer.phase("template"):
+        template = load_template_by_name(CONFIG["printer"].get("template_name","debug"))
 
-    server_thread = threading.Thread(
-        target=start_server, daemon=True
-    )
-    server_thread.start()
+    listening = threading.Event()
+    with timer.phase("server"):
+        server_thread = threading.Thread(
+            target=start_server, args=(listening,), daemon=True
+        )
+        server_thread.start()
+        while not listening.wait(0.1):
+            if not server_thread.is_alive():
+                raise SystemExit("Server failed to start")
+
+    with timer.phase("queue index"):
+        count_messages()
+
+    start_processing_loop(printer, template)
+    timer.done()
 
     while True:
         time.sleep(1)
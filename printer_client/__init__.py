@@ -0,0 +1,6 @@
+"""Client library for the ESC/POS print server."""
+from .aio import AsyncPrinterClient
+from .client import ConnectionPool, PrinterClient
+from .protocol import Response, Status
+
+__all__ = ["AsyncPrinterClient", "ConnectionPool", "PrinterClient", "Response", "Status"]
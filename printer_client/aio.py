@@ -0,0 +1,131 @@
+import asyncio
+import io
+from typing import Any, Dict, Iterable, List, Mapping, Optional, Tuple
+
+from .client import message_request
+from .protocol import DEFAULT_PORT, ImageSource, Response, parse_response, request_chunks
+
+# Preview replies carry a whole base64 PNG on one line
+READ_LIMIT = 16 * 1024 * 1024
+
+Streams = Tuple[asyncio.StreamReader, asyncio.StreamWriter]
+
+
+class AsyncPrinterClient:
+    """
+    asyncio client for the print server, with the same pooling, keep-alive
+    and idempotent-resend behaviour as PrinterClient.
+    """
+
+    def __init__(
+        self,
+        host: str = "localhost",
+        port: int = DEFAULT_PORT,
+        api_key: Optional[str] = None,
+        pool_size: int = 4,
+        timeout: Optional[float] = 30.0,
+    ) -> None:
+        self.host, self.port, self.api_key, self.timeout = host, port, api_key, timeout
+        self._idle: List[Streams] = []
+        self._slots = asyncio.Semaphore(pool_size)
+
+    async def __aenter__(self) -> "AsyncPrinterClient":
+        return self
+
+    async def __aexit__(self, *exc: Any) -> None:
+        await self.close()
+
+    async def close(self) -> None:
+        while self._idle:
+            _, writer = self._idle.pop()
+            writer.close()
+            try:
+                await writer.wait_closed()
+            except OSError:
+                pass
+
+    async def send_message(
+        self, text: str = "", image: Optional[ImageSource] = None, **fields: Any
+    ) -> Response:
+        return await self.request(*message_request(text, image, **fields))
+
+    async def summary(self) -> Response:
+        return await self.request({"type": "summary"})
+
+    async def control(self, message_processing: bool) -> Response:
+        return await self.request(
+            {"type": "control", "value": {"message_processing": message_processing}}
+        )
+
+    async def profile(self, action: str) -> Response:
+        """Start, stop or dump the server's sampling profiler (needs the control permission)."""
+        return await self.request({"type": "control", "value": {"profiler": action}})
+
+    async def trace(self, action: str) -> Response:
+        """Start, stop or dump the server's per-action print tracing."""
+        return await self.request({"type": "control", "value": {"trace": action}})
+
+    async def preview(
+        self, text: str = "", image: Optional[ImageSource] = None, fmt: str = "text", **fields: Any
+    ) -> Response:
+        return await self.request(
+            {"type": "preview", "text": text, "format": fmt, **fields}, image
+        )
+
+    async def send_batch(self, messages: Iterable[Mapping[str, Any]]) -> List[Response]:
+        """Send many messages concurrently over the pool; replies are in input order."""
+        return list(
+            await asyncio.gather(*(self.send_message(**m) for m in messages))
+        )
+
+    async def request(self, payload: Dict[str, Any], image: Optional[ImageSource] = None) -> Response:
+        payload = {**payload, "keep_alive": True}
+        if self.api_key:
+            payload["api_key"] = self.api_key
+        async with self._slots:
+            while True:
+                streams, reused = await self._connection()
+                reader, writer = streams
+                try:
+                    await asyncio.wait_for(self._send(writer, payload, image), self.timeout)
+                    line = await asyncio.wait_for(reader.readline(), self.timeout)
+                except (BrokenPipeError, ConnectionResetError):
+                    if not reused:
+                        writer.close()
+                        raise
+                    line = b""
+                except BaseException:
+                    writer.close()
+                    raise
+                if line.endswith(b"\n"):
+                    self._idle.append(streams)
+                    return parse_response(line)
+                writer.close()
+                if not reused:
+                    raise ConnectionError("Server closed the connection without a reply")
+                # The server closed the connection first; resend on a new one
+
+    async def _connection(self) -> Tuple[Streams, bool]:
+        while self._idle:
+            reader, writer = self._idle.pop()
+            if not reader.at_eof() and not writer.is_closing():
+                return (reader, writer), True
+            writer.close()
+        streams = await asyncio.wait_for(
+            asyncio.open_connection(self.host, self.port, limit=READ_LIMIT), self.timeout
+        )
+        return streams, False
+
+    @staticmethod
+    async def _send(
+        writer: asyncio.StreamWriter, payload: Dict[str, Any], image: Optional[ImageSource]
+    ) -> None:
+        stream = image if isinstance(image, io.IOBase) else None
+        rewind = stream.tell() if stream is not None else 0
+        try:
+            for chunk in request_chunks(payload, image):
+                writer.write(chunk)
+                await writer.drain()
+        finally:
+            if stream is not None:
+                stream.seek(rewind)
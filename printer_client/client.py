@@ -0,0 +1,244 @@
+import io
+import queue
+import select
+import socket
+import threading
+import uuid
+from contextlib import contextmanager
+from typing import Any, Dict, Iterable, Iterator, List, Mapping, Optional, Tuple
+
+from .protocol import (
+    DEFAULT_PORT,
+    UPLOAD_CHUNK,
+    ImageSource,
+    Response,
+    parse_response,
+    request_chunks,
+)
+
+Request = Tuple[Dict[str, Any], Optional[ImageSource]]
+
+
+class Connection:
+    def __init__(self, host: str, port: int, timeout: Optional[float]) -> None:
+        self.sock = socket.create_connection((host, port), timeout=timeout)
+        self.reader = self.sock.makefile("rb")
+        self.served = 0
+        self.broken = False
+
+    def send(self, payload: Dict[str, Any], image: Optional[ImageSource] = None) -> None:
+        stream = image if isinstance(image, io.IOBase) else None
+        rewind = stream.tell() if stream is not None else 0
+        buffer = bytearray()
+        try:
+            # Coalesce small pieces, so a request is not split into tiny segments
+            for chunk in request_chunks(payload, image):
+                buffer += chunk
+                if len(buffer) >= UPLOAD_CHUNK:
+                    self.sock.sendall(buffer)
+                    buffer.clear()
+            self.sock.sendall(buffer)
+        finally:
+            if stream is not None:
+                stream.seek(rewind)
+
+    def readline(self) -> bytes:
+        return self.reader.readline()
+
+    def dropped(self) -> bool:
+        """An idle connection is only readable if the server has closed it."""
+        try:
+            return bool(select.select([self.sock], [], [], 0)[0])
+        except (OSError, ValueError):
+            return True
+
+    def close(self) -> None:
+        self.reader.close()
+        self.sock.close()
+
+
+class ConnectionPool:
+    """
+    Keeps up to `size` connections open for reuse. Connections the server
+    has closed in the meantime (idle timeout, or a server without keep-alive)
+    are discarded when taken from the pool.
+    """
+
+    def __init__(self, host: str, port: int, size: int = 4, timeout: Optional[float] = 30.0) -> None:
+        self.host, self.port, self.timeout = host, port, timeout
+        self._idle: "queue.LifoQueue[Connection]" = queue.LifoQueue()
+        self._slots = threading.BoundedSemaphore(size)
+
+    @contextmanager
+    def connection(self) -> Iterator[Connection]:
+        with self._slots:
+            conn = self._take_idle() or Connection(self.host, self.port, self.timeout)
+            try:
+                yield conn
+            except BaseException:
+                conn.broken = True
+                raise
+            finally:
+                if conn.broken:
+                    conn.close()
+                else:
+                    self._idle.put(conn)
+
+    def _take_idle(self) -> Optional[Connection]:
+        while True:
+            try:
+                conn = self._idle.get_nowait()
+            except queue.Empty:
+                return None
+            if not conn.dropped():
+                return conn
+            conn.close()
+
+    def close(self) -> None:
+        while True:
+            try:
+                self._idle.get_nowait().close()
+            except queue.Empty:
+                return
+
+
+class PrinterClient:
+    """
+    Synchronous client for the print server, safe to share between threads.
+
+    Connections are pooled and kept alive between requests. Messages get an
+    idempotency key unless one is given, so a request that has to be resent
+    after a dropped connection is stored only once.
+    """
+
+    def __init__(
+        self,
+        host: str = "localhost",
+        port: int = DEFAULT_PORT,
+        api_key: Optional[str] = None,
+        pool_size: int = 4,
+        timeout: Optional[float] = 30.0,
+    ) -> None:
+        self.api_key = api_key
+        self.pool = ConnectionPool(host, port, pool_size, timeout)
+
+    def __enter__(self) -> "PrinterClient":
+        return self
+
+    def __exit__(self, *exc: Any) -> None:
+        self.close()
+
+    def close(self) -> None:
+        self.pool.close()
+
+    def send_message(self, text: str = "", image: Optional[ImageSource] = None, **fields: Any) -> Response:
+        """Queue a message. `image` is a path, bytes or binary file; other fields
+        (sender, priority, custom_template, cut, idempotency_key) go as-is."""
+        return self.request(*message_request(text, image, **fields))
+
+    def summary(self) -> Response:
+        return self.request({"type": "summary"})
+
+    def control(self, message_processing: bool) -> Response:
+        return self.request(
+            {"type": "control", "value": {"message_processing": message_processing}}
+        )
+
+    def profile(self, action: str) -> Response:
+        """Start, stop or dump the server's sampling profiler (needs the control permission)."""
+        return self.request({"type": "control", "value": {"profiler": action}})
+
+    def trace(self, action: str) -> Response:
+        """Start, stop or dump the server's per-action print tracing."""
+        return self.request({"type": "control", "value": {"trace": action}})
+
+    def preview(
+        self, text: str = "", image: Optional[ImageSource] = None, fmt: str = "text", **fields: Any
+    ) -> Response:
+        return self.request({"type": "preview", "text": text, "format": fmt, **fields}, image)
+
+    def request(self, payload: Dict[str, Any], image: Optional[ImageSource] = None) -> Response:
+        payload = self._with_auth(payload)
+        while True:
+            with self.pool.connection() as conn:
+                reused = conn.served > 0
+                try:
+                    conn.send(payload, image)
+                    line = conn.readline()
+                except (BrokenPipeError, ConnectionResetError):
+                    if not reused:
+                        raise
+                    line = b""
+                if line:
+                    conn.served += 1
+                    return parse_response(line)
+                conn.broken = True
+                if not reused:
+                    raise ConnectionError("Server closed the connection without a reply")
+                # The server closed the connection first; resend on a new one
+
+    def send_batch(self, messages: Iterable[Mapping[str, Any]], depth: int = 16) -> List[Response]:
+        """
+        Send many messages (each a dict of send_message arguments), pipelining
+        up to `depth` requests on one connection. Replies are in input order.
+        """
+        requests = [message_request(**m) for m in messages]
+        requests = [(self._with_auth(p), image) for p, image in requests]
+        results: List[Response] = []
+        while len(results) < len(requests):
+            answered, reused = self._pipeline(requests, results, depth)
+            if answered == 0 and not reused and depth == 1:
+                raise ConnectionError("Server closed the connection without a reply")
+            if answered <= 1 and not reused and len(results) < len(requests):
+                # The server does not keep connections alive; closing one with
+                # requests still unread may reset it before the reply arrives
+                depth = 1
+        return results
+
+    def _pipeline(
+        self, requests: List[Request], results: List[Response], depth: int
+    ) -> Tuple[int, bool]:
+        """
+        Send requests from len(results) on one connection. Returns the number
+        of replies read and whether the connection came from the pool.
+        """
+        answered = 0
+        with self.pool.connection() as conn:
+            reused = conn.served > 0
+            in_flight = 0
+            next_index = len(results)
+            try:
+                while len(results) < len(requests):
+                    while next_index < len(requests) and in_flight < depth:
+                        conn.send(*requests[next_index])
+                        in_flight += 1
+                        next_index += 1
+                    line = conn.readline()
+                    if not line:
+                        break
+                    in_flight -= 1
+                    answered += 1
+                    conn.served += 1
+                    results.append(parse_response(line))
+                    if depth == 1:
+                        return answered, reused
+            except (BrokenPipeError, ConnectionResetError):
+                pass
+            if in_flight:
+                # Unanswered requests are resent on a new connection
+                conn.broken = True
+        return answered, reused
+
+    def _with_auth(self, payload: Dict[str, Any]) -> Dict[str, Any]:
+        payload = {**payload, "keep_alive": True}
+        if self.api_key:
+            payload["api_key"] = self.api_key
+        return payload
+
+
+def message_request(
+    text: str = "", image: Optional[ImageSource] = None, **fields: Any
+) -> Request:
+    payload: Dict[str, Any] = {"type": "message", "text": text, **fields}
+    payload.setdefault("idempotency_key", uuid.uuid4().hex)
+    return payload, image
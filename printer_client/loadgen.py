@@ -0,0 +1,113 @@
+"""
+Load generator for server benchmarks.
+
+    python -m printer_client.loadgen --api-key KEY --requests 2000 --concurrency 32
+    python -m printer_client.loadgen --api-key KEY --type summary --rate 500 --duration 30
+
+Without --rate, `concurrency` clients send back to back (closed loop). With
+--rate, requests start on a fixed schedule and latency is measured from the
+scheduled start, so a slow server cannot hide its queueing delay.
+"""
+import argparse
+import asyncio
+import json
+import time
+from collections import Counter
+from typing import Any, Dict, List, Optional
+
+from .aio import AsyncPrinterClient
+from .protocol import DEFAULT_PORT
+
+
+def percentile(sorted_values: List[float], q: float) -> float:
+    if not sorted_values:
+        return 0.0
+    return sorted_values[min(len(sorted_values) - 1, int(q * len(sorted_values)))]
+
+
+async def run(args: argparse.Namespace) -> Dict[str, Any]:
+    latencies: List[float] = []
+    statuses: Counter = Counter()
+    image: Optional[bytes] = None
+    if args.image:
+        with open(args.image, "rb") as f:
+            image = f.read()
+    text = "x" * args.text_size
+    count = args.requests or int(args.rate * args.duration)
+
+    async with AsyncPrinterClient(
+        args.host, args.port, args.api_key, pool_size=args.concurrency, timeout=args.timeout
+    ) as client:
+
+        async def one(i: int, scheduled: float) -> None:
+            await asyncio.sleep(max(0.0, scheduled - time.perf_counter()))
+            try:
+                if args.type == "message":
+                    # Unique text, so identical-job dedupe does not skew the run
+                    response = await client.send_message(
+                        f"{i} {text}", image, sender="loadgen", cut=False
+                    )
+                elif args.type == "preview":
+                    response = await client.preview(f"{i} {text}", image)
+                else:
+                    response = await client.summary()
+                statuses[response.status.value] += 1
+            except (OSError, asyncio.TimeoutError) as e:
+                statuses[type(e).__name__] += 1
+            latencies.append(time.perf_counter() - scheduled)
+
+        begin = time.perf_counter()
+        if args.rate:
+            await asyncio.gather(*(one(i, begin + i / args.rate) for i in range(count)))
+        else:
+            pending = iter(range(count))
+
+            async def worker() -> None:
+                for i in pending:
+                    await one(i, time.perf_counter())
+
+            await asyncio.gather(*(worker() for _ in range(args.concurrency)))
+        elapsed = time.perf_counter() - begin
+
+    latencies.sort()
+    return {
+        "type": args.type,
+        "requests": count,
+        "elapsed_s": round(elapsed, 3),
+        "throughput_rps": round(count / elapsed, 1) if elapsed else 0.0,
+        "p50_ms": round(percentile(latencies, 0.50) * 1000, 2),
+        "p90_ms": round(percentile(latencies, 0.90) * 1000, 2),
+        "p99_ms": round(percentile(latencies, 0.99) * 1000, 2),
+        "max_ms": round((latencies[-1] if latencies else 0.0) * 1000, 2),
+        "statuses": dict(statuses),
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Drive the print server with synthetic load")
+    parser.add_argument("--host", default="localhost")
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT)
+    parser.add_argument("--api-key")
+    parser.add_argument("--type", choices=("message", "summary", "preview"), default="message")
+    parser.add_argument("--requests", type=int, default=0, help="total requests (default: rate x duration)")
+    parser.add_argument("--concurrency", type=int, default=8, help="connections / closed-loop clients")
+    parser.add_argument("--rate", type=float, default=0, help="open loop: requests per second")
+    parser.add_argument("--duration", type=float, default=10, help="seconds, with --rate")
+    parser.add_argument("--text-size", type=int, default=100)
+    parser.add_argument("--image", help="image file to attach to each request")
+    parser.add_argument("--timeout", type=float, default=30)
+    parser.add_argument("--json", action="store_true", help="print the result as one JSON line")
+    args = parser.parse_args()
+    if not args.requests and not args.rate:
+        args.requests = 1000
+
+    result = asyncio.run(run(args))
+    if args.json:
+        print(json.dumps(result))
+        return
+    for key, value in result.items():
+        print(f"{key:15} {value}")
+
+
+if __name__ == "__main__":
+    main()
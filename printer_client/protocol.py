@@ -0,0 +1,115 @@
+import base64
+import io
+import json
+import re
+from dataclasses import dataclass
+from enum import Enum
+from pathlib import Path
+from typing import Any, BinaryIO, Dict, Iterator, Optional, Union
+
+DEFAULT_PORT = 9000
+# A multiple of 3, so base64 chunks concatenate into one valid string
+UPLOAD_CHUNK = 3 * 64 * 1024
+
+ImageSource = Union[str, Path, bytes, BinaryIO]
+
+
+class Status(str, Enum):
+    STORED = "stored"
+    STORED_WITHOUT_IMAGE = "stored_without_image"
+    DUPLICATE = "duplicate"
+    UPDATED = "updated"
+    SUMMARY = "summary"
+    PREVIEW = "preview"
+    PROFILE = "profile"
+    RATE_LIMITED = "rate_limited"
+    BUSY = "busy"
+    UNAUTHORIZED = "unauthorized"
+    FORBIDDEN = "forbidden"
+    ERROR = "error"
+
+
+_FIXED = {
+    "Message stored.": Status.STORED,
+    "Message stored without image.": Status.STORED_WITHOUT_IMAGE,
+    "Message already stored.": Status.DUPLICATE,
+    "Message processing updated.": Status.UPDATED,
+    "Profiler started.": Status.UPDATED,
+    "Profiler already running.": Status.UPDATED,
+    "Tracing started.": Status.UPDATED,
+    "Unauthorized.": Status.UNAUTHORIZED,
+    "Forbidden.": Status.FORBIDDEN,
+}
+_RETRY = re.compile(r"(Rate limited|Busy), retry after (\d+(?:\.\d+)?) s\.")
+
+
+@dataclass(frozen=True)
+class Response:
+    status: Status
+    text: str
+    retry_after: Optional[float] = None
+    data: Optional[Dict[str, Any]] = None
+
+    @property
+    def ok(self) -> bool:
+        return self.status not in (
+            Status.RATE_LIMITED,
+            Status.BUSY,
+            Status.UNAUTHORIZED,
+            Status.FORBIDDEN,
+            Status.ERROR,
+        )
+
+    @property
+    def error(self) -> Optional[str]:
+        if self.status is Status.ERROR:
+            return self.text.removeprefix("Error: ")
+        return None
+
+
+def parse_response(line: bytes) -> Response:
+    text = line.decode("utf-8", errors="replace").strip()
+    if text in _FIXED:
+        return Response(_FIXED[text], text)
+    if match := _RETRY.fullmatch(text):
+        status = Status.RATE_LIMITED if match[1] == "Rate limited" else Status.BUSY
+        return Response(status, text, retry_after=float(match[2]))
+    if text.startswith("{"):
+        data = json.loads(text)
+        if "preview" in data:
+            status = Status.PREVIEW
+        elif "profile" in data or "trace" in data:
+            status = Status.PROFILE
+        else:
+            status = Status.SUMMARY
+        return Response(status, text, data=data)
+    return Response(Status.ERROR, text)
+
+
+def _open(image: ImageSource) -> BinaryIO:
+    if isinstance(image, (str, Path)):
+        return open(image, "rb")
+    if isinstance(image, (bytes, bytearray)):
+        return io.BytesIO(image)
+    return image
+
+
+def request_chunks(payload: Dict[str, Any], image: Optional[ImageSource] = None) -> Iterator[bytes]:
+    """
+    Encode one request line. An image is base64-encoded chunk by chunk while
+    it is sent, so large files are never held in memory whole.
+    """
+    body = json.dumps(payload, separators=(",", ":")).encode()
+    if image is None:
+        yield body + b"\n"
+        return
+
+    yield body[:-1] + (b',"image":"' if payload else b'"image":"')
+    f = _open(image)
+    try:
+        while chunk := f.read(UPLOAD_CHUNK):
+            yield base64.b64encode(chunk)
+    finally:
+        if f is not image:
+            f.close()
+    yield b'"}\n'